@@ -16,11 +16,79 @@
 
 """Base driver module used to create compatible driver for specific SAN storage."""
 
+import logging
+import os
+import sys
 from time import time
 from san_exporter.main import load_config
-from threading import Thread
+from san_exporter.utils import instrumentation
+from threading import Event, Lock, Thread
 
-from prometheus_client import CollectorRegistry
+from prometheus_client import CollectorRegistry, Gauge
+
+# Maximum number of concurrent requests sent to a storage backend
+MAX_WORKERS = 4
+# Consecutive failed collections opening the circuit of a backend
+FAILURE_THRESHOLD = 3
+# Maximum wait before probing a failing backend again - s
+MAX_BACKOFF = 3600
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of the collection of a backend
+
+    closed: the storage is collected every interval.
+    open: after failure_threshold consecutive failures the storage is not
+    requested anymore for the backoff time, doubled at each new opening up to
+    max_backoff.
+    half_open: the backoff time is over, one collection probes the storage,
+    it closes the circuit on success or opens it again on failure.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    # Value of the state metric
+    STATES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, backoff=60, max_backoff=MAX_BACKOFF):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = self.CLOSED
+        self.failures = 0
+        # Number of openings since the circuit was closed
+        self.openings = 0
+        self.open_until = 0
+        self.lock = Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == self.OPEN and time() >= self.open_until:
+                logging.info("Probing backend %s after %s failed collections", self.name, self.failures)
+                self.state = self.HALF_OPEN
+            return self.state != self.OPEN
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logging.info("Backend %s recovered, its circuit is closed", self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self.openings = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                backoff = min(self.backoff * 2 ** self.openings, self.max_backoff)
+                self.state = self.OPEN
+                self.openings += 1
+                self.open_until = time() + backoff
+                logging.warning("Backend %s failed %s times, its circuit is open for %ss",
+                                self.name, self.failures, backoff)
 
 
 class ExporterDriver(Thread):
@@ -29,7 +97,10 @@ class ExporterDriver(Thread):
     """
 
     def __init__(self, config=None, interval=10):
-        super().__init__()
+        # The exporter does not wait for the collection loops to stop, the
+        # resources held on the storages are released by shutdown()
+        super().__init__(daemon=True)
+        self.stopped = Event()
         config_global = load_config()
         self.config = config
         self.client = None
@@ -37,8 +108,21 @@ class ExporterDriver(Thread):
         self.cache_file = config['name'] + ".data"
         self.optional_metrics = config.get('optional_metrics', {})
         self.time_last_request = time()
+        self.collection_start = time()
         self.timeout = config_global.get('timeout', 600)
         self.timeout = config.get('timeout', self.timeout)
+        self.max_workers = config_global.get('max_workers', MAX_WORKERS)
+        self.max_workers = config.get('max_workers', self.max_workers)
+        # Settings of the HTTP client of the drivers using a REST API
+        self.http_config = dict(config_global.get('http', {}))
+        self.http_config.update(config.get('http', {}))
+        breaker_config = dict(config_global.get('circuit_breaker', {}))
+        breaker_config.update(config.get('circuit_breaker', {}))
+        self.circuit_breaker = CircuitBreaker(
+            config['name'],
+            failure_threshold=breaker_config.get('failure_threshold', FAILURE_THRESHOLD),
+            backoff=breaker_config.get('backoff', interval),
+            max_backoff=breaker_config.get('max_backoff', MAX_BACKOFF))
         if config.get('pools'):
             pools = config['pools'].split(',')
             if pools[0].strip().lower() == 'all':
@@ -48,6 +132,54 @@ class ExporterDriver(Thread):
         else:
             self.get_all_pools = True
 
+    def collect_allowed(self):
+        """Whether the storage can be collected, False while the circuit of the backend is open"""
+        allowed = self.circuit_breaker.allow_request()
+        if allowed:
+            self.collection_start = time()
+        return allowed
+
+    def collect_section(self, section, collector, *args):
+        """Call the collector of a section of the data and record its duration"""
+        start = time()
+        try:
+            return collector(*args)
+        finally:
+            instrumentation.section_duration.labels(
+                backend_name=self.config['name'], section=section).set(time() - start)
+
+    def _record_collection(self):
+        backend_name = self.config['name']
+        instrumentation.collection_duration.labels(backend_name=backend_name).observe(
+            time() - self.collection_start)
+        instrumentation.consecutive_failures.labels(backend_name=backend_name).set(
+            self.circuit_breaker.failures)
+
+    def collect_succeeded(self):
+        self.circuit_breaker.record_success()
+        self._record_collection()
+        instrumentation.last_success.labels(backend_name=self.config['name']).set_to_current_time()
+        if os.path.isfile(self.cache_file):
+            instrumentation.snapshot_bytes.labels(backend_name=self.config['name']).set(
+                os.path.getsize(self.cache_file))
+
+    def collect_failed(self, message='Error while collecting metrics of backend %s'):
+        """Log the current exception and record the failure, the traceback is only logged while the circuit is closed"""
+        if self.circuit_breaker.state == CircuitBreaker.CLOSED:
+            logging.error(message, self.config['name'], exc_info=True)
+        else:
+            logging.warning(message + ': %s', self.config['name'], sys.exc_info()[1])
+        self.record_failure()
+
+    def record_failure(self):
+        """Record a failed collection already logged by the driver"""
+        self.circuit_breaker.record_failure()
+        self._record_collection()
+
+    def shutdown(self):
+        """Stop collecting and release the resources held on the storage, called when the exporter stops"""
+        self.stopped.set()
+
     def run(self):
         pass
 
@@ -65,6 +197,7 @@ class Metrics:
         self.optional_metrics = config.get('optional_metrics', {})
 
         self.registry = CollectorRegistry()
+        self.define_collection_metrics()
 
         # NOTE:
         # Some SAN storage using several terminology for group of disks, physical disk, virtual disk.
@@ -79,3 +212,21 @@ class Metrics:
         #   backend_name: backend name
         #   pool_name: pool/CPG name
         pool_labels = ["backend_name", "pool_name"]  # noqa: F841
+
+    def define_collection_metrics(self):
+        collection_labels = ["backend_name"]
+        self.gauge_san_exporter_circuit_state = Gauge(
+            'san_exporter_circuit_state', 'Circuit of the collection [0-Closed, 1-Open, 2-Half open]',
+            collection_labels, registry=self.registry)
+        self.gauge_san_exporter_data_age = Gauge(
+            'san_exporter_data_age_seconds', 'Time since the data of the backend was collected - s',
+            collection_labels, registry=self.registry)
+        self.gauge_san_exporter_data_stale = Gauge(
+            'san_exporter_data_stale', 'The data is the last collected one, the backend is failing [0-No, 1-Yes]',
+            collection_labels, registry=self.registry)
+
+    def parse_collection_metrics(self, backend_name, circuit_state, data_age, stale):
+        self.gauge_san_exporter_circuit_state.labels(backend_name=backend_name).set(
+            CircuitBreaker.STATES[circuit_state])
+        self.gauge_san_exporter_data_age.labels(backend_name=backend_name).set(data_age)
+        self.gauge_san_exporter_data_stale.labels(backend_name=backend_name).set(int(stale))
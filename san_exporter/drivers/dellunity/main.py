@@ -15,13 +15,23 @@
 #
 
 import storops
-import requests
 import logging
+from storops.lib.resource import ResourceList
+from storops.unity.calculator import calculators
+from storops.unity.resource.metric import UnityMetricRealTimeQuery
 from time import sleep, time
 from san_exporter.drivers import base_driver
 from san_exporter.drivers.dellunity import prometheus_metrics
+from san_exporter.drivers.dellunity import realtime_query
+from san_exporter.utils.http_client import create_http_client
 from san_exporter.utils.utils import cache_data
 
+REST_HEADERS = {'Content-type': 'application/json',
+                'Accept': 'application/json',
+                'X-EMC-REST-CLIENT': 'true'}
+# Number of instances of a page of Unity collections
+MAX_PER_PAGE = 2000
+
 
 class DellUnityExporter(base_driver.ExporterDriver):
     def __init__(self, config=None, interval=10):
@@ -30,18 +40,111 @@ class DellUnityExporter(base_driver.ExporterDriver):
         self.dellunity_username = config['dellunity_username']
         self.dellunity_password = config['dellunity_password']
         self.backend_name = config['name']
+        self.base_url = 'https://' + self.dellunity_api_ip
+        self.auth = (self.dellunity_username, self.dellunity_password)
+        # One authenticated session (cookie + CSRF token) for every REST
+        # call, shared with the storops client
+        self.session = create_http_client(self.backend_name, self.http_config,
+                                          pool_maxsize=self.max_workers)
+        self.session.auth = self.auth
+        self.session.verify = False
+        self.session.headers.update(REST_HEADERS)
         self.data = storops.UnitySystem(
             self.dellunity_api_ip, self.dellunity_username,
             self.dellunity_password)
-        self.data.enable_perf_stats(interval=self.interval)
+        self.share_session()
+        # storops perf stats, only used without the real-time metric query
+        # and only while the backend is scraped. They are updated by the
+        # collection loop, storops does not poll from its own thread.
+        self.perf_stats_enabled = False
+        self.perf_paths = None
+        # REST calls sent by the exporter itself, the other requests of the
+        # shared session are sent by storops
+        self.exporter_calls = 0
+        self.last_calls = (0, 0)
+        # Performance of LUNs, disks, SPs and FC ports is read in bulk with
+        # one real-time metric query instead of per storops object
+        self.metric_query = None
+        if config.get('metric_realtime_query', True):
+            paths = []
+            for section, metric_paths in [
+                    ('lun', realtime_query.LUN_METRIC_PATHS),
+                    ('disk', realtime_query.DISK_METRIC_PATHS),
+                    ('node', realtime_query.NODE_METRIC_PATHS),
+                    ('fcport', realtime_query.FCPORT_METRIC_PATHS)]:
+                if self.optional_metrics.get(section):
+                    paths.extend(metric_paths.values())
+            if paths:
+                self.metric_query = realtime_query.UnityMetricQuery(
+                    self, paths, self.interval)
+
+    def share_session(self):
+        # storops sends its requests with the requests session of
+        # UnitySystem._cli._rest.http_client
+        try:
+            self.data._cli._rest.http_client.session = self.session
+        except AttributeError:
+            logging.warning("Can not share the REST session with storops, "
+                            "it keeps its own session")
+
+    def reset_session(self):
+        self.session.cookies.clear()
+        self.session.headers.pop('EMC-CSRF-TOKEN', None)
+
+    def send(self, method, path, params=None, body=None):
+        if method != 'GET' and 'EMC-CSRF-TOKEN' not in self.session.headers:
+            # Unity only accepts POST/DELETE with the CSRF token of the
+            # session, returned by any GET request
+            self.get('/api/types/loginSessionInfo/instances')
+        self.exporter_calls += 1
+        response = self.session.request(
+            method, self.base_url + path, params=params, json=body)
+        if 'EMC-CSRF-TOKEN' in response.headers:
+            self.session.headers['EMC-CSRF-TOKEN'] = \
+                response.headers['EMC-CSRF-TOKEN']
+        return response
+
+    def request(self, method, path, params=None, body=None):
+        response = self.send(method, path, params, body)
+        if response.status_code == 401:
+            # The Unity session expired: log in again and retry once
+            logging.info("REST session of Unity %s expired"
+                         % self.dellunity_api_ip)
+            self.reset_session()
+            response = self.send(method, path, params, body)
+        response.raise_for_status()
+        return response.json()
+
+    def get(self, path, params=None):
+        return self.request('GET', path, params=params)
+
+    def post(self, path, body):
+        return self.request('POST', path, body=body)
+
+    def get_instances(self, resource_type, fields):
+        instances = []
+        page = 1
+        while True:
+            response = self.get('/api/types/%s/instances' % resource_type,
+                                {'fields': fields, 'page': page,
+                                 'per_page': MAX_PER_PAGE})
+            instances.extend(entry['content']
+                             for entry in response['entries'])
+            if not any(link.get('rel') == 'next'
+                       for link in response.get('links', [])):
+                return instances
+            page += 1
+
+    def get_metric_values(self, values, metric_paths, object_id):
+        """Fields of an object, the ones without query result are left out"""
+        return {field: values[path][object_id]
+                for field, path in metric_paths.items()
+                if object_id in values.get(path, {})}
 
     def get_system_info(self):
         system_data = {}
-        url = 'https://' + self.dellunity_api_ip \
-              + '/api/types/basicSystemInfo/instances'
         try:
-            response = requests.get(url, headers={
-                'Accept': 'application/json'}, verify=False).json()[
+            response = self.get('/api/types/basicSystemInfo/instances')[
                 'entries'][0]['content']
             system_data.update({'softwareVersion': response['softwareVersion'],
                                 'apiVersion': response['apiVersion']})
@@ -82,6 +185,42 @@ class DellUnityExporter(base_driver.ExporterDriver):
             pool_data.append(data)
         return pool_data
 
+    def get_node_metrics_bulk(self, values):
+        node_data = []
+        for t in self.data.get_sp():
+            data = {'id': t.id, 'temperature': t.temperature}
+            data.update(self.get_metric_values(
+                values, realtime_query.NODE_METRIC_PATHS, t.id))
+            node_data.append(data)
+        return node_data
+
+    def get_fcport_metrics_bulk(self, values):
+        fcport_data = []
+        for t in self.data.get_fc_port():
+            data = {'id': t.id, 'slot_number': t.slot_number}
+            data.update(self.get_metric_values(
+                values, realtime_query.FCPORT_METRIC_PATHS, t.id))
+            fcport_data.append(data)
+        return fcport_data
+
+    def get_lun_metrics_bulk(self, values):
+        lun_data = []
+        for lun in self.get_instances('lun', 'id,name'):
+            data = {'name': lun['name']}
+            data.update(self.get_metric_values(
+                values, realtime_query.LUN_METRIC_PATHS, lun['id']))
+            lun_data.append(data)
+        return lun_data
+
+    def get_disk_metrics_bulk(self, values):
+        disk_data = []
+        for disk in self.get_instances('disk', 'id,name'):
+            data = {'name': disk['name']}
+            data.update(self.get_metric_values(
+                values, realtime_query.DISK_METRIC_PATHS, disk['id']))
+            disk_data.append(data)
+        return disk_data
+
     def get_node_metrics(self):
         node_object = self.data.get_sp()
         node_data = []
@@ -119,21 +258,14 @@ class DellUnityExporter(base_driver.ExporterDriver):
         #   2: Inactive - Alerts that are already resolved
         # Link: https://www.delltechnologies.com/en-vn/documentation/unity-family/unity-p-cli-user-guide/09-unity-cli-br-manage-events-and-alerts.htm
         if software_version >= '5.0.0':
-            url = 'https://' + self.dellunity_api_ip \
-                  + '/api/types/alert/instances?fields=message,severity&' \
-                    'filter=severity ne 4 and severity ne 6 and state ne 2'
+            alert_filter = 'severity ne 4 and severity ne 6 and state ne 2'
         else:
             logging.warning("Software version is {}, can not get alert state!"
                             .format(software_version))
-            url = 'https://' + self.dellunity_api_ip \
-                  + '/api/types/alert/instances?fields=message,severity&' \
-                    'filter=severity ne 4 and severity ne 6'
-        auth = (self.dellunity_username, self.dellunity_password)
-        header = {'Content-type': 'application/json',
-                  'Accept': 'application/json',
-                  'X-EMC-REST-CLIENT': 'true'}
-        response = requests.get(
-            url, auth=auth, headers=header, verify=False).json()
+            alert_filter = 'severity ne 4 and severity ne 6'
+        response = self.get('/api/types/alert/instances',
+                            {'fields': 'message,severity',
+                             'filter': alert_filter})
         return response['entries']
 
     def get_lun_metrics(self):
@@ -160,34 +292,112 @@ class DellUnityExporter(base_driver.ExporterDriver):
             disk_data.append(data)
         return disk_data
 
+    def get_perf_metrics(self):
+        if self.perf_stats_enabled:
+            self.update_perf_stats()
+        data = {}
+        if self.optional_metrics.get('node'):
+            data['nodes'] = self.get_node_metrics()
+        if self.optional_metrics.get('fcport'):
+            data['fcport'] = self.get_fcport_metrics()
+        if self.optional_metrics.get('lun'):
+            data['luns'] = self.get_lun_metrics()
+        if self.optional_metrics.get('disk'):
+            data['disks'] = self.get_disk_metrics()
+        return data
+
+    def use_storops_perf(self):
+        return self.metric_query is None and any(
+            self.optional_metrics.get(section)
+            for section in ('node', 'fcport', 'lun', 'disk'))
+
+    def enable_perf_stats(self):
+        if self.perf_stats_enabled or not self.use_storops_perf():
+            return
+        logging.info("Enable storops perf stats of backend %s"
+                     % self.backend_name)
+        # UnitySystem.enable_perf_stats without its timer thread: with an
+        # interval of 0 storops only keeps the records added by
+        # update_perf_stats
+        rsc_clz_list = ResourceList.get_rsc_clz_list(
+            self.data._default_rsc_list_with_perf_stats())
+        self.perf_paths = calculators.get_all_paths(rsc_clz_list)
+        self.data._cli.enable_perf_metric(0, None, rsc_clz_list)
+        self.perf_stats_enabled = True
+
+    def update_perf_stats(self):
+        """Add the newest result of the storops metric query, once per cycle"""
+        queries = UnityMetricRealTimeQuery.get_query_list(
+            self.data._cli, self.interval, paths=self.perf_paths)
+        if queries:
+            self.data.add_metric_record(
+                queries.get_query_result(self.perf_paths))
+
+    def disable_perf_stats(self):
+        if not self.perf_stats_enabled:
+            return
+        logging.info("Disable storops perf stats of backend %s"
+                     % self.backend_name)
+        try:
+            self.data.disable_perf_stats()
+        except Exception:
+            logging.warning("Can not disable storops perf stats of backend "
+                            "%s" % self.backend_name, exc_info=True)
+        self.perf_stats_enabled = False
+
+    def get_rest_calls(self):
+        """REST calls of the exporter and of storops since the last cycle"""
+        total = self.session.get_stats()['requests']
+        storops_calls = total - self.exporter_calls
+        rest_calls = {'exporter': self.exporter_calls - self.last_calls[0],
+                      'storops': storops_calls - self.last_calls[1]}
+        self.last_calls = (self.exporter_calls, storops_calls)
+        return rest_calls
+
+    def get_perf_metrics_bulk(self):
+        values = self.metric_query.get_values()
+        data = {}
+        if self.optional_metrics.get('node'):
+            data['nodes'] = self.get_node_metrics_bulk(values)
+        if self.optional_metrics.get('fcport'):
+            data['fcport'] = self.get_fcport_metrics_bulk(values)
+        if self.optional_metrics.get('lun'):
+            data['luns'] = self.get_lun_metrics_bulk(values)
+        if self.optional_metrics.get('disk'):
+            data['disks'] = self.get_disk_metrics_bulk(values)
+        return data
+
     def run(self):
         while True:
             sleep(self.interval)
             if time() - self.time_last_request > self.timeout:
+                # storops must not keep polling while nobody scrapes
+                self.disable_perf_stats()
+                continue
+            if not self.collect_allowed():
                 continue
             data = {}
             try:
+                self.enable_perf_stats()
                 data['system_info'] = self.get_system_info()
                 if not data['system_info']:
+                    self.record_failure()
                     continue
-                if self.optional_metrics.get('node'):
-                    data['nodes'] = self.get_node_metrics()
+                if self.metric_query:
+                    data.update(self.collect_section('perf', self.get_perf_metrics_bulk))
+                else:
+                    data.update(self.collect_section('perf', self.get_perf_metrics))
                 if self.optional_metrics.get('pool'):
-                    data['pools'] = self.get_pool_info()
-                if self.optional_metrics.get('fcport'):
-                    data['fcport'] = self.get_fcport_metrics()
+                    data['pools'] = self.collect_section('pools', self.get_pool_info)
                 if self.optional_metrics.get('alert'):
-                    data['alerts'] = self.get_alert_metrics(
-                        data['system_info']['softwareVersion'])
-                if self.optional_metrics.get('lun'):
-                    data['luns'] = self.get_lun_metrics()
-                if self.optional_metrics.get('disk'):
-                    data['disks'] = self.get_disk_metrics()
+                    data['alerts'] = self.collect_section(
+                        'alerts', self.get_alert_metrics, data['system_info']['softwareVersion'])
+                data['rest_calls'] = self.get_rest_calls()
             except:
-                logging.error("Somethings wrong when getting metrics. Retry"
-                              "after sleep!")
+                self.collect_failed("Somethings wrong when getting metrics of backend %s. Retry after sleep!")
                 continue
             cache_data(self.cache_file, data)
+            self.collect_succeeded()
 
 
 def main(config, interval):
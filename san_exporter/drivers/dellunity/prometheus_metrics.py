@@ -43,6 +43,9 @@ class DellUnityMetrics(base_driver.Metrics):
         self.gauge_san_unhealthy_nodes = Gauge(
             'san_unhealthyNodes', 'Unhealthy Nodes', labels,
             registry=self.registry)
+        self.gauge_san_rest_calls = Gauge(
+            'san_rest_calls', 'REST calls to Unity during the last cycle',
+            labels + ['client'], registry=self.registry)
         self.gauge_san_online_nodes = Gauge(
             'san_onlineNodes', 'Online Nodes', labels, registry=self.registry)
         if self.optional_metrics.get('pool'):
@@ -147,31 +150,28 @@ class DellUnityMetrics(base_driver.Metrics):
             'san_node_write_kb', 'Node Write Data Rate - KiB/s',
             node_labels, registry=self.registry)
 
+    def set_perf(self, gauge, labelvalues, value, divisor=1):
+        """Set a performance gauge, a value missing from the metric query removes the series"""
+        if value is None:
+            gauge._metrics.pop(tuple(str(label) for label in labelvalues), None)
+        else:
+            gauge.labels(*labelvalues).set(value / divisor)
+
     def parse_node_metrics(self, node):
-        block_read_iops = node['block_read_iops']
-        block_write_iops = node['block_write_iops']
-        utilization = node['utilization']
-        temperature = node['temperature']
-        write_byte_rate = node['write_byte_rate']
-        read_byte_rate = node['read_byte_rate']
-        self.gauge_san_node_block_read_iops.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            node_id=node['id']).set(block_read_iops)
-        self.gauge_san_node_block_write_iops.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            node_id=node['id']).set(block_write_iops)
-        self.gauge_san_node_read_data_rate.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            node_id=node['id']).set(read_byte_rate / 1024)
-        self.gauge_san_node_write_data_rate.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            node_id=node['id']).set(write_byte_rate / 1024)
-        self.gauge_san_node_utilization.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            node_id=node['id']).set(utilization)
+        labelvalues = (self.backend_name, self.san_ip, node['id'])
+        self.set_perf(self.gauge_san_node_block_read_iops, labelvalues,
+                      node.get('block_read_iops'))
+        self.set_perf(self.gauge_san_node_block_write_iops, labelvalues,
+                      node.get('block_write_iops'))
+        self.set_perf(self.gauge_san_node_read_data_rate, labelvalues,
+                      node.get('read_byte_rate'), 1024)
+        self.set_perf(self.gauge_san_node_write_data_rate, labelvalues,
+                      node.get('write_byte_rate'), 1024)
+        self.set_perf(self.gauge_san_node_utilization, labelvalues,
+                      node.get('utilization'))
         self.gauge_san_node_temperature.labels(
             backend_name=self.backend_name, san_ip=self.san_ip,
-            node_id=node['id']).set(temperature)
+            node_id=node['id']).set(node['temperature'])
 
     def define_fcport_metrics(self):
         fcport_labels = ['backend_name', 'san_ip', 'id']
@@ -189,22 +189,15 @@ class DellUnityMetrics(base_driver.Metrics):
             fcport_labels, registry=self.registry)
 
     def parse_fcport_metrics(self, fcport):
-        read_iops = fcport['read_iops']
-        write_iops = fcport['write_iops']
-        read_byte_rate = fcport['read_byte_rate']
-        write_byte_rate = fcport['write_byte_rate']
-        self.gauge_san_fcport_read_iops.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            id=fcport['id']).set(read_iops)
-        self.gauge_san_fcport_write_iops.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            id=fcport['id']).set(write_iops)
-        self.gauge_san_fcport_read_data_rate.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            id=fcport['id']).set(read_byte_rate / 1024)
-        self.gauge_san_fcport_write_data_rate.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip,
-            id=fcport['id']).set(write_byte_rate / 1024)
+        labelvalues = (self.backend_name, self.san_ip, fcport['id'])
+        self.set_perf(self.gauge_san_fcport_read_iops, labelvalues,
+                      fcport.get('read_iops'))
+        self.set_perf(self.gauge_san_fcport_write_iops, labelvalues,
+                      fcport.get('write_iops'))
+        self.set_perf(self.gauge_san_fcport_read_data_rate, labelvalues,
+                      fcport.get('read_byte_rate'), 1024)
+        self.set_perf(self.gauge_san_fcport_write_data_rate, labelvalues,
+                      fcport.get('write_byte_rate'), 1024)
 
     def define_alert_metrics(self):
         alert_labels = ['backend_name', 'san_ip', 'alert_id', 'log_content']
@@ -237,27 +230,17 @@ class DellUnityMetrics(base_driver.Metrics):
             registry=self.registry)
 
     def parse_lun_metrics(self, lun):
-        name = lun['name']
-        read_iops = lun['read_iops']
-        write_iops = lun['write_iops']
-        read_byte_rate = lun['read_byte_rate']
-        write_byte_rate = lun['write_byte_rate']
-        response_time = lun['response_time']
-        self.gauge_san_lun_read_iops.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            read_iops)
-        self.gauge_san_lun_write_iops.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            write_iops)
-        self.gauge_san_lun_read_data_rate.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            read_byte_rate / 1024)
-        self.gauge_san_lun_write_data_rate.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            write_byte_rate / 1024)
-        self.gauge_san_lun_response_time.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            response_time / 1000)
+        labelvalues = (self.backend_name, self.san_ip, lun['name'])
+        self.set_perf(self.gauge_san_lun_read_iops, labelvalues,
+                      lun.get('read_iops'))
+        self.set_perf(self.gauge_san_lun_write_iops, labelvalues,
+                      lun.get('write_iops'))
+        self.set_perf(self.gauge_san_lun_read_data_rate, labelvalues,
+                      lun.get('read_byte_rate'), 1024)
+        self.set_perf(self.gauge_san_lun_write_data_rate, labelvalues,
+                      lun.get('write_byte_rate'), 1024)
+        self.set_perf(self.gauge_san_lun_response_time, labelvalues,
+                      lun.get('response_time'), 1000)
 
     def define_disk_metrics(self):
         disk_labels = ['backend_name', 'san_ip', 'name']
@@ -278,30 +261,28 @@ class DellUnityMetrics(base_driver.Metrics):
             disk_labels, registry=self.registry)
 
     def parse_disk_metrics(self, disk):
-        name = disk['name']
-        read_iops = disk['read_iops']
-        write_iops = disk['write_iops']
-        read_byte_rate = disk['read_byte_rate']
-        write_byte_rate = disk['write_byte_rate']
-        response_time = disk['response_time']
-        self.gauge_san_disk_write_iops.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            write_iops)
-        self.gauge_san_disk_read_iops.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            read_iops)
-        self.gauge_san_disk_read_data_rate.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            read_byte_rate / 1024)
-        self.gauge_san_disk_write_data_rate.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            write_byte_rate / 1024)
-        self.gauge_san_disk_response_time.labels(
-            backend_name=self.backend_name, san_ip=self.san_ip, name=name).set(
-            response_time / 1000)
+        labelvalues = (self.backend_name, self.san_ip, disk['name'])
+        self.set_perf(self.gauge_san_disk_read_iops, labelvalues,
+                      disk.get('read_iops'))
+        self.set_perf(self.gauge_san_disk_write_iops, labelvalues,
+                      disk.get('write_iops'))
+        self.set_perf(self.gauge_san_disk_read_data_rate, labelvalues,
+                      disk.get('read_byte_rate'), 1024)
+        self.set_perf(self.gauge_san_disk_write_data_rate, labelvalues,
+                      disk.get('write_byte_rate'), 1024)
+        self.set_perf(self.gauge_san_disk_response_time, labelvalues,
+                      disk.get('response_time'), 1000)
+
+    def parse_rest_calls(self, rest_calls):
+        for client, calls in rest_calls.items():
+            self.gauge_san_rest_calls.labels(
+                backend_name=self.backend_name, san_ip=self.san_ip,
+                client=client).set(calls)
 
     def parse_metrics(self, data):
         self.parse_system_info(data['system_info'])
+        if data.get('rest_calls'):
+            self.parse_rest_calls(data['rest_calls'])
         if self.optional_metrics.get('pool'):
             if len(data['pools']):
                 for pool_info in data['pools']:
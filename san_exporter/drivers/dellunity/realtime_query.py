@@ -0,0 +1,110 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import logging
+from time import time
+
+# Unity metric paths of every exported field, "*" matches every SP/object
+LUN_METRIC_PATHS = {
+    'read_iops': 'sp.*.storage.lun.*.readsRate',
+    'write_iops': 'sp.*.storage.lun.*.writesRate',
+    'read_byte_rate': 'sp.*.storage.lun.*.readBytesRate',
+    'write_byte_rate': 'sp.*.storage.lun.*.writeBytesRate',
+    'response_time': 'sp.*.storage.lun.*.responseTime',
+}
+DISK_METRIC_PATHS = {
+    'read_iops': 'sp.*.physical.disk.*.readsRate',
+    'write_iops': 'sp.*.physical.disk.*.writesRate',
+    'read_byte_rate': 'sp.*.physical.disk.*.readBytesRate',
+    'write_byte_rate': 'sp.*.physical.disk.*.writeBytesRate',
+    'response_time': 'sp.*.physical.disk.*.responseTime',
+}
+NODE_METRIC_PATHS = {
+    'block_read_iops': 'sp.*.storage.summary.readsRate',
+    'block_write_iops': 'sp.*.storage.summary.writesRate',
+    'read_byte_rate': 'sp.*.storage.summary.readBytesRate',
+    'write_byte_rate': 'sp.*.storage.summary.writeBytesRate',
+    'utilization': 'sp.*.cpu.summary.utilization',
+}
+FCPORT_METRIC_PATHS = {
+    'read_iops': 'sp.*.fibreChannel.fePort.*.readsRate',
+    'write_iops': 'sp.*.fibreChannel.fePort.*.writesRate',
+    'read_byte_rate': 'sp.*.fibreChannel.fePort.*.readBytesRate',
+    'write_byte_rate': 'sp.*.fibreChannel.fePort.*.writeBytesRate',
+}
+# Fields that are not rates: the value of an object is the max of the SPs
+# instead of their sum
+LATENCY_FIELDS = ('responseTime',)
+# Minimum sampling interval of a real-time query
+MIN_QUERY_INTERVAL = 5
+
+
+class UnityMetricQuery(object):
+    """
+    Real-time metric query of a Unity system.
+
+    One metricRealTimeQuery covers every path, its results hold the values
+    of all the objects of a path, so a cycle costs one request whatever the
+    number of LUNs/disks. The query is created once and read every cycle.
+    """
+
+    def __init__(self, rest, paths, interval):
+        self.rest = rest
+        self.paths = sorted(set(paths))
+        self.interval = max(MIN_QUERY_INTERVAL, interval - interval % MIN_QUERY_INTERVAL)
+        self.query_id = None
+        self.created_at = 0
+
+    def create(self):
+        response = self.rest.post('/api/types/metricRealTimeQuery/instances',
+                                  {'paths': self.paths, 'interval': self.interval})
+        self.query_id = response['content']['id']
+        self.created_at = time()
+        logging.debug("Created Unity real-time metric query %s", self.query_id)
+
+    def _to_values(self, path, values):
+        """Map object id to value, the rates of the SPs are summed, the latencies keep the max"""
+        combine = max if path.rsplit('.', 1)[-1] in LATENCY_FIELDS else sum
+        result = {}
+        for sp, sp_values in values.items():
+            if isinstance(sp_values, dict):
+                for object_id, value in sp_values.items():
+                    if object_id in result:
+                        result[object_id] = combine((result[object_id], float(value)))
+                    else:
+                        result[object_id] = float(value)
+            else:
+                # SP level path: the SP is the object
+                result[sp] = float(sp_values)
+        return result
+
+    def get_values(self):
+        """Newest values of every path: path -> {object id: value}"""
+        if self.query_id is None:
+            self.create()
+        response = self.rest.get('/api/types/metricQueryResult/instances',
+                                 {'filter': 'queryId EQ %s' % self.query_id})
+        latest = {}
+        for entry in response.get('entries', []):
+            content = entry['content']
+            path = content['path']
+            if path not in latest or content['timestamp'] > latest[path]['timestamp']:
+                latest[path] = content
+        if not latest and time() - self.created_at > 2 * self.interval:
+            # The query expired or was deleted, recreate it next cycle
+            logging.warning("Unity real-time metric query %s has no result", self.query_id)
+            self.query_id = None
+        return {path: self._to_values(path, content['values']) for path, content in latest.items()}
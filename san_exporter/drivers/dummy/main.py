@@ -71,6 +71,9 @@ class DummyExporter(base_driver.ExporterDriver):
                 if time() - self.time_last_request > self.timeout:
                     sleep(self.interval)
                     continue
+                if not self.collect_allowed():
+                    sleep(self.interval)
+                    continue
                 # self.client_login()
                 data = {}
                 # system_info = self.client.getStorageSystemInfo()
@@ -122,8 +125,9 @@ class DummyExporter(base_driver.ExporterDriver):
                     data['cpu_statistics'] = cpu_statistics
                 # caching data to file using pickle
                 cache_data(self.cache_file, data)
+                self.collect_succeeded()
             except BaseException:
-                logging.error('Error: ', exc_info=True)
+                self.collect_failed()
             finally:
                 self.client_logout()
 
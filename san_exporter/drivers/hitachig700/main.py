@@ -14,14 +14,35 @@
 #    under the License.
 #
 
-import requests
 import logging
-import json
+import re
+from collections import OrderedDict
 from time import sleep, time
 from san_exporter.drivers import base_driver
 from san_exporter.drivers.hitachig700 import prometheus_metrics
+from san_exporter.utils.http_client import create_http_client
 from san_exporter.utils.utils import cache_data
 
+# Performance statistics of the perf optional section - experimental.
+# The statistics are not part of the Configuration Manager REST API of every
+# version, so no endpoint nor response field is built in: a section is only
+# collected when its path, id and fields are set in the 'perf' config of the
+# backend.
+#   path: statistics of every object in one request, relative to the storage URL
+#   id: field identifying the object
+#   time: optional field of the sample time, only the newest sample is kept
+#   fields: exported statistic -> unit, appended to the metric name
+#     e.g. responseTime: ms -> san_port_response_time_ms
+#   top, sort_by: only export the top objects with the highest sort_by value
+PERF_SECTIONS = ('port', 'ldev', 'mp')
+PERF_REQUIRED_OPTIONS = ('path', 'id', 'fields')
+PERF_DEFAULTS = {
+    'time': None,
+    # 0: every object
+    'top': 0,
+    'sort_by': None,
+}
+
 
 class HitachiG700Exporter(base_driver.ExporterDriver):
     def __init__(self, config=None, interval=10):
@@ -33,6 +54,34 @@ class HitachiG700Exporter(base_driver.ExporterDriver):
         self.backend_name = config['name']
         self.serial = config['serial']
         self.auth = (self.g700_username, self.g700_password)
+        self.session = create_http_client(self.backend_name, self.http_config,
+                                          pool_maxsize=self.max_workers)
+        # Responses of the current cycle: path -> JSON response
+        self.responses = {}
+        # The storage ID and the session are kept across cycles
+        self.storage_id = None
+        self.token = None
+        self.session_id = None
+        self.session_create_count = 0
+        self.session_create_latency = 0
+        self.perf_sections = {}
+        if self.optional_metrics.get('perf'):
+            self.perf_sections = self.get_perf_sections(config.get('perf') or {})
+
+    def get_perf_sections(self, perf):
+        """Configured perf sections, the incomplete ones are not collected"""
+        perf_sections = {}
+        for section, perf_config in perf.items():
+            missing = [option for option in PERF_REQUIRED_OPTIONS
+                       if not (perf_config or {}).get(option)]
+            if section not in PERF_SECTIONS or missing:
+                logging.warning("The perf section %s of backend %s is unknown or misses %s, "
+                                "it is not collected", section, self.backend_name, missing)
+                continue
+            perf_sections[section] = dict(PERF_DEFAULTS, **perf_config)
+        if not perf_sections:
+            logging.warning("No perf section configured for backend %s", self.backend_name)
+        return perf_sections
 
     def check_connection_and_get_storage_id(self):
         try:
@@ -41,7 +90,7 @@ class HitachiG700Exporter(base_driver.ExporterDriver):
                            'storages' % (self.g700_api_ip, self.g700_api_port)
             self.headers = {'Accept': 'application/json',
                             "Content-Type": "application/json"}
-            data = requests.get(
+            data = self.session.get(
                 self.baseURL, headers=self.headers, verify=False).json()
             logging.info("Connect to VSP %s successfully!" % self.g700_api_ip)
         except:
@@ -60,25 +109,70 @@ class HitachiG700Exporter(base_driver.ExporterDriver):
         return storage_id
 
     def get_session_token(self):
+        if self.stopped.is_set():
+            # Do not open a session that shutdown() would not delete
+            return None
+        headers = {'Accept': 'application/json',
+                   "Content-Type": "application/json"}
+        start = time()
         try:
-            data = requests.post(
-                self.baseURL + '/sessions', headers=self.headers,
+            data = self.session.post(
+                self.baseURL + '/sessions', headers=headers,
                 auth=self.auth, verify=False).json()
-            return data['token']
-        except:
+            self.token = data['token']
+            self.session_id = data['sessionId']
+        except Exception:
             logging.error(
                 "Can not get session token!! Permission denied by VSP %s. "
                 "Check your account!!" % self.g700_api_ip)
             return None
+        self.session_create_count += 1
+        self.session_create_latency = time() - start
+        headers['Authorization'] = 'Session ' + self.token
+        self.headers = headers
+        return self.token
+
+    def delete_session(self):
+        if self.session_id is None:
+            return
+        try:
+            self.session.delete(
+                self.baseURL + '/sessions/%s' % self.session_id,
+                headers=self.headers, verify=False)
+        except Exception:
+            logging.warning("Can not delete session %s of VSP %s"
+                            % (self.session_id, self.g700_api_ip))
+        finally:
+            self.token = None
+            self.session_id = None
+
+    def shutdown(self):
+        super().shutdown()
+        self.delete_session()
+
+    def get_json(self, path=''):
+        """GET a resource of the storage once per cycle"""
+        if path not in self.responses:
+            response = self.session.get(
+                self.baseURL + path, headers=self.headers, verify=False)
+            if response.status_code == 401:
+                # The session expired: create a new one and retry once
+                logging.info("Session of VSP %s expired" % self.g700_api_ip)
+                self.token = None
+                self.session_id = None
+                if not self.get_session_token():
+                    response.raise_for_status()
+                response = self.session.get(
+                    self.baseURL + path, headers=self.headers, verify=False)
+            self.responses[path] = response.json()
+        return self.responses[path]
 
     def get_system_info(self):
-        system_info = requests.get(
-            self.baseURL, headers=self.headers, verify=False).json()
+        system_info = self.get_json()
         return system_info
 
     def get_hardware_status(self):
-        url = self.baseURL + '/components/instance'
-        rq_data = requests.get(url, headers=self.headers, verify=False).json()
+        rq_data = self.get_json('/components/instance')
         return rq_data
 
     def check_status_of_hardware(self, hw_name, data):
@@ -115,8 +209,7 @@ class HitachiG700Exporter(base_driver.ExporterDriver):
         return unhealthy_hw
 
     def get_node_metrics(self):
-        url = self.baseURL + '/components/instance'
-        rq_data = requests.get(url, headers=self.headers, verify=False).json()
+        rq_data = self.get_json('/components/instance')
         total_nodes = 0
         normal_nodes = 0
         for i in rq_data['ctls']:
@@ -128,89 +221,124 @@ class HitachiG700Exporter(base_driver.ExporterDriver):
         return node_data
 
     def get_pool_metrics(self):
-        url = self.baseURL + '/pools'
-        rq_data = requests.get(url, headers=self.headers, verify=False).json()
+        rq_data = self.get_json('/pools')
         return rq_data['data']
 
     def get_disk_metrics(self):
-        url = self.baseURL + '/drives'
-        rq_data = requests.get(url, headers=self.headers, verify=False).json()
+        rq_data = self.get_json('/drives')
         return rq_data['data']
 
     def get_alert_info(self):
-        url = self.baseURL + '/alerts?type=DKC&type=CTL1&type=CTL2'
-        alert_data = requests.get(
-            url, headers=self.headers, verify=False).json()
+        alert_data = self.get_json('/alerts?type=DKC&type=CTL1&type=CTL2')
         return alert_data['data']
 
-    def remove_dupe_dicts(self, list):
-        list_of_strings = [
-            json.dumps(d, sort_keys=True)
-            for d in list
-        ]
-        list_of_strings = set(list_of_strings)
-        return [
-            json.loads(s)
-            for s in list_of_strings
-        ]
-
     def get_alert_metrics(self):
         alert_info = self.get_alert_info()
-        unhealthy_hw = self.get_unhealthy_hardware()
-        alert_metrics = []
+        unhealthy_locations = set(hw['location'] for hw in self.get_unhealthy_hardware())
+        # Alerts are deduplicated on (errorDetail, errorLevel, errorSection, location)
+        alert_keys = OrderedDict()
         for al in alert_info:
-            resolved = True
-            for i in al['actionCodes']:
-                for hw in unhealthy_hw:
-                    if i['accLocation'] == hw['location']:
-                        resolved = False
-            if not resolved:
-                alert = {'errorDetail': al['errorDetail'],
-                         'errorLevel': 'Serious',
-                         'errorSection': al['errorSection'],
-                         'location': al['location']}
-                alert_metrics.append(alert)
-            else:
-                alert = {'errorDetail': al['errorDetail'],
-                         'errorLevel': al['errorLevel'],
-                         'errorSection': al['errorSection'],
-                         'location': al['location']}
-                alert_metrics.append(alert)
-        return self.remove_dupe_dicts(alert_metrics)
-
-    def run(self):
-        while True:
+            resolved = not any(i['accLocation'] in unhealthy_locations
+                               for i in al['actionCodes'])
+            error_level = al['errorLevel'] if resolved else 'Serious'
+            alert_keys[(al['errorDetail'], error_level, al['errorSection'], al['location'])] = None
+        return [{'errorDetail': detail, 'errorLevel': level,
+                 'errorSection': section, 'location': location}
+                for detail, level, section, location in alert_keys]
+
+    def get_latest_samples(self, section):
+        """Newest sample of every object of a perf section"""
+        perf_config = self.perf_sections[section]
+        latest = {}
+        for sample in self.get_json(perf_config['path'])['data']:
+            object_id = sample[perf_config['id']]
+            if object_id not in latest or not perf_config['time'] or \
+                    sample.get(perf_config['time'], '') > \
+                    latest[object_id].get(perf_config['time'], ''):
+                latest[object_id] = sample
+        samples = list(latest.values())
+        if perf_config['top'] and perf_config['sort_by']:
+            samples.sort(key=lambda sample: sample.get(perf_config['sort_by'], 0),
+                         reverse=True)
+            samples = samples[:perf_config['top']]
+        return samples
+
+    def get_section_perf_metrics(self, section):
+        perf_config = self.perf_sections[section]
+        perf_data = []
+        for sample in self.get_latest_samples(section):
+            labels = {'backend_name': self.backend_name,
+                      'san_ip': self.g700_api_ip,
+                      section + '_id': str(sample[perf_config['id']])}
+            for field, unit in perf_config['fields'].items():
+                if sample.get(field) is None:
+                    continue
+                # e.g. readResponseTime, ms -> san_ldev_read_response_time_ms
+                name = 'san_%s_%s' % (section, re.sub(
+                    '([A-Z])', r'_\1', field).lower())
+                if unit and not name.endswith('_' + unit):
+                    name += '_' + unit
+                perf_data.append({
+                    'name': name,
+                    'labels': labels,
+                    'description': '%s %s - %s' % (section.upper(), field, unit),
+                    'value': sample[field]})
+        return perf_data
+
+    def get_perf_metrics(self):
+        perf_data = []
+        for section in self.perf_sections:
+            # A failing section must not drop the other metrics of the storage
+            try:
+                perf_data.extend(self.get_section_perf_metrics(section))
+            except Exception:
+                logging.warning("Can not get the perf section %s of VSP %s, skipping it",
+                                section, self.g700_api_ip, exc_info=True)
+        return perf_data
+
+    def run(self):  # noqa: C901
+        while not self.stopped.is_set():
             sleep(self.interval)
             if time() - self.time_last_request > self.timeout:
+                # Do not hold a VSP session while the backend is not scraped
+                self.delete_session()
                 continue
-            storage_id = self.check_connection_and_get_storage_id()
-            if not storage_id:
+            if not self.collect_allowed():
                 continue
-            self.baseURL = 'https://%s:%s/ConfigurationManager/v1/objects/' \
-                           'storages/%s' % (self.g700_api_ip,
-                                            self.g700_api_port, storage_id)
-            token = self.get_session_token()
-            if not token:
+            if not self.storage_id:
+                self.storage_id = self.check_connection_and_get_storage_id()
+                if not self.storage_id:
+                    self.record_failure()
+                    continue
+                self.baseURL = 'https://%s:%s/ConfigurationManager/v1/' \
+                               'objects/storages/%s' % (self.g700_api_ip,
+                                                        self.g700_api_port,
+                                                        self.storage_id)
+            if not self.token and not self.get_session_token():
+                self.record_failure()
                 continue
-            self.headers = {'Accept': 'application/json',
-                            "Content-Type": "application/json",
-                            'Authorization': 'Session ' + token}
             data = {}
+            self.responses = {}
             try:
                 data['system_info'] = self.get_system_info()
                 if self.optional_metrics.get('node'):
-                    data['node'] = self.get_node_metrics()
+                    data['node'] = self.collect_section('node', self.get_node_metrics)
                 if self.optional_metrics.get('pool'):
-                    data['pool'] = self.get_pool_metrics()
+                    data['pool'] = self.collect_section('pool', self.get_pool_metrics)
                 if self.optional_metrics.get('disk'):
-                    data['disk'] = self.get_disk_metrics()
+                    data['disk'] = self.collect_section('disk', self.get_disk_metrics)
                 if self.optional_metrics.get('alert'):
-                    data['alert'] = self.get_alert_metrics()
+                    data['alert'] = self.collect_section('alert', self.get_alert_metrics)
+                if self.optional_metrics.get('perf'):
+                    data['perf'] = self.collect_section('perf', self.get_perf_metrics)
+                data['session'] = {
+                    'create_count': self.session_create_count,
+                    'create_latency': self.session_create_latency}
             except:
-                logging.error("Somethings wrong when getting metrics! Retry "
-                              "after sleep.")
+                self.collect_failed("Somethings wrong when getting metrics of backend %s! Retry after sleep.")
                 continue
             cache_data(self.cache_file, data)
+            self.collect_succeeded()
 
 
 def main(config, interval):
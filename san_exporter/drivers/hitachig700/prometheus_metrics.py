@@ -32,6 +32,9 @@ class HitachiG700Metrics(base_driver.Metrics):
             self.define_node_metrics()
         if self.optional_metrics.get('alert'):
             self.define_alert_metrics()
+        self.define_session_metrics()
+        # Gauges of the perf section, created at the first sample
+        self.perf_metrics = {}
 
     def parse_system_info(self, system_info):
         self.info_san.info({
@@ -125,8 +128,40 @@ class HitachiG700Metrics(base_driver.Metrics):
                     backend_name=self.backend_name, san_ip=self.san_ip,
                     log_content=log_content).set(1)
 
+    def define_session_metrics(self):
+        self.gauge_san_session_creations = Gauge(
+            'san_session_creations', 'Number of VSP sessions created',
+            self.labels, registry=self.registry)
+        self.gauge_san_session_create_latency = Gauge(
+            'san_session_create_latency_seconds',
+            'Duration of the last VSP session creation - s', self.labels,
+            registry=self.registry)
+
+    def parse_session_metrics(self, session):
+        self.gauge_san_session_creations.labels(
+            backend_name=self.backend_name, san_ip=self.san_ip).set(
+            session['create_count'])
+        self.gauge_san_session_create_latency.labels(
+            backend_name=self.backend_name, san_ip=self.san_ip).set(
+            session['create_latency'])
+
+    def parse_perf_metrics(self, data):
+        # Objects out of the LDEV top-N must not be exported anymore
+        for metric in self.perf_metrics.values():
+            metric._metrics.clear()
+        for value in data:
+            name = value['name']
+            labels = value['labels']
+            if name not in self.perf_metrics:
+                metric = Gauge(name, value['description'], labels.keys(),
+                               registry=self.registry)
+                self.perf_metrics[name] = metric
+            self.perf_metrics[name].labels(**labels).set(value['value'])
+
     def parse_metrics(self, data):
         self.parse_system_info(data['system_info'])
+        if data.get('session'):
+            self.parse_session_metrics(data['session'])
         if self.optional_metrics.get('pool'):
             self.parse_pool_metrics(data['pool'])
         if self.optional_metrics.get('node'):
@@ -134,6 +169,8 @@ class HitachiG700Metrics(base_driver.Metrics):
         if self.optional_metrics.get('alert'):
             self.san_alert._metrics.clear()
             self.parse_alert_metrics(data['alert'])
+        if self.optional_metrics.get('perf'):
+            self.parse_perf_metrics(data['perf'])
 
     def get_metrics(self):
         metrics = generate_latest(self.registry)
@@ -15,21 +15,44 @@
 #
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep, time
 import json
 
-import requests
 from hpe3parclient import version
 from hpe3parclient import exceptions as hpeexceptions
 
 from san_exporter.drivers.hpe3par.system_report import HPE3ParClientCustom
+from san_exporter.drivers.hpe3par.ssh_session import HPE3ParSSHSession, SSH_COMMAND_TIMEOUT
 
+from san_exporter.utils.http_client import CONNECT_TIMEOUT, READ_TIMEOUT, create_http_client
 from san_exporter.utils.utils import cache_data
 
 from san_exporter.drivers import base_driver
 from san_exporter.drivers.hpe3par import prometheus_metrics
 
 MIN_CLIENT_VERSION = '4.2.0'
+# WSAPI sessions expire after 15 minutes of inactivity (default), the session
+# is recreated before that if it was not used for this number of seconds.
+SESSION_REFRESH_INTERVAL = 600
+
+# Optional System Reporter sections: option name -> (client API, default group by)
+SYSTEM_REPORTER_SECTIONS = {
+    'vlun': ('getVlunsStatisticsAtTime', 'volumeName'),
+    'pd': ('getPhysicalDiskStatisticsAtTime', 'id,type'),
+    'qos': ('getQoSStatisticsAtTime', 'type,name'),
+    'remotecopy': ('getRemoteCopyStatisticsAtTime', 'targetName,linkId'),
+}
+
+# Metric name of the System Reporter fields, {} is replaced by read/write/total
+SYSTEM_REPORTER_FIELDS = {
+    'IO': 'number_{}_io',
+    'KBytes': '{}_kb',
+    'serviceTimeMS': '{}_service_time_ms',
+    'IOSizeKB': '{}_IOSize_kb',
+    'queueLength': 'queue_length',
+    'busyPct': 'busy_pct',
+}
 
 
 class HPE3ParExporter(base_driver.ExporterDriver):
@@ -45,10 +68,23 @@ class HPE3ParExporter(base_driver.ExporterDriver):
         self.san_ssh_user = config['san_ssh_user']
         self.san_ssh_pass = config['san_ssh_pass']
         self.san_ssh_port = config['san_ssh_port']
+        self.session_refresh_interval = config.get('session_refresh_interval', SESSION_REFRESH_INTERVAL)
+        self.session_last_used = 0
+        self.login_count = 0
+        # Current alerts of the array: alert id -> alert record
+        self.alerts = {}
+        # CLI commands (e.g. showalert) share one long-lived SSH connection
+        self.ssh_session = HPE3ParSSHSession(self.san_ssh_ip, self.san_ssh_user, self.san_ssh_pass,
+                                             self.san_ssh_port,
+                                             command_timeout=config.get('ssh_command_timeout', SSH_COMMAND_TIMEOUT))
+        # Requests sent to WSAPI outside of the hpe3parclient
+        self.session = create_http_client(self.backend_name, self.http_config)
 
     def _create_client(self):
-        cl = HPE3ParClientCustom(self.hpe3par_api_url)
-        cl.setSSHOptions(self.san_ssh_ip, self.san_ssh_user, self.san_ssh_pass, self.san_ssh_port)
+        # The WSAPI requests get the (connect, read) timeouts of the http config
+        timeout = (self.http_config.get('connect_timeout', CONNECT_TIMEOUT),
+                   self.http_config.get('read_timeout', READ_TIMEOUT))
+        cl = HPE3ParClientCustom(self.hpe3par_api_url, timeout=timeout)
         client_version = version
 
         if client_version < MIN_CLIENT_VERSION:
@@ -61,12 +97,21 @@ class HPE3ParExporter(base_driver.ExporterDriver):
             logging.error(ex_msg)
             # TODO: implement raise the exception here.
             return None
+        # The client logs in again by itself when a request is rejected
+        # with 401, every authentication is counted
+        authenticate = cl.http.authenticate
+
+        def counted_authenticate(*args, **kwargs):
+            authenticate(*args, **kwargs)
+            self.login_count += 1
+        cl.http.authenticate = counted_authenticate
         return cl
 
     def client_login(self):
         try:
             logging.debug("Connecting to 3PAR")
             self.client.login(self.hpe3par_username, self.hpe3par_password)
+            self.session_last_used = time()
             logging.info("Logged in to: " + self.hpe3par_api_url)
         except hpeexceptions.HTTPUnauthorized as ex:
             msg = ("Failed to Login to 3PAR (%(url)s) because %(err)s" %
@@ -75,7 +120,24 @@ class HPE3ParExporter(base_driver.ExporterDriver):
 
     def client_logout(self):
         logging.debug("Logout from 3PAR backend: %s", self.backend_name)
-        self.client.logout()
+        try:
+            self.client.logout()
+        except Exception as ex:
+            logging.warning("Failed to logout from 3PAR backend %s: %s", self.backend_name, ex)
+        finally:
+            self.client.http.session_key = None
+
+    def has_session(self):
+        return self.client.http.session_key is not None
+
+    def ensure_session(self):
+        """Reuse the WSAPI session across cycles, recreate it before it expires"""
+        if self.has_session():
+            if time() - self.session_last_used < self.session_refresh_interval:
+                return
+            logging.debug("Refreshing WSAPI session of backend: %s", self.backend_name)
+            self.client_logout()
+        self.client_login()
 
     def _get_token_session(self):
         url = self.hpe3par_api_url + '/credentials'
@@ -84,7 +146,7 @@ class HPE3ParExporter(base_driver.ExporterDriver):
             "password": self.hpe3par_password
         }
         headers = {'content-type': 'application/json'}
-        response = requests.post(url=url, data=json.dumps(payload), headers=headers)
+        response = self.session.post(url=url, data=json.dumps(payload), headers=headers)
         if response.status_code != 200:
             logging.warning(response.json())
             return None
@@ -97,6 +159,23 @@ class HPE3ParExporter(base_driver.ExporterDriver):
             pool_object['pool_avail_space'] = pool_avail_space
         return pool_object
 
+    def _get_pool_info_by_name(self, pool_name):
+        pool_object = self.client.getCPG(pool_name.strip())
+        return self._get_pool_info(pool_object)
+
+    def _get_pools_info(self):
+        if self.get_all_pools:
+            pools = self.client.getCPGs()['members']
+            get_pool_info = self._get_pool_info
+        else:
+            pools = self.config['pools'].split(',')
+            get_pool_info = self._get_pool_info_by_name
+        if not pools:
+            return []
+        # The lookups of each CPG are independent, run them concurrently
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pools))) as executor:
+            return list(executor.map(get_pool_info, pools))
+
     def _get_cpu_stats(self):
         # Get the cpu statistics data for last 5 minutes
         cpu_stats = self.client.getCPUStatisticsAtTime(samplefreq='hires')
@@ -120,92 +199,165 @@ class HPE3ParExporter(base_driver.ExporterDriver):
         cpu_stats = self.client.getCPGStatisticsAtTime(samplefreq='hires', query=query)
         return cpu_stats['members']
 
+    def _get_system_reporter_stats(self, section):
+        api, groupby = SYSTEM_REPORTER_SECTIONS[section]
+        sr_config = self.config.get('system_reporter', {}).get(section, {})
+        groupby = sr_config.get('groupby', groupby)
+        stats = getattr(self.client, api)(samplefreq='hires', report_identifier='groupby:' + groupby,
+                                          query=sr_config.get('query'))
+        members = stats.get('members', [])
+
+        # Keep only the busiest objects to bound the number of series
+        if sr_config.get('top'):
+            sort_by = sr_config.get('sort_by', 'IO.total').split('.')
+
+            def sort_key(member):
+                value = member
+                for k in sort_by:
+                    value = value.get(k, 0) if isinstance(value, dict) else 0
+                return value
+
+            members = sorted(members, key=sort_key, reverse=True)[:sr_config['top']]
+        return self._convert_system_reporter_stats(section, members, groupby.split(','))
+
+    def _convert_system_reporter_stats(self, section, members, groupby):
+        stats = []
+        for member in members:
+            labels = {
+                'backend_name': self.backend_name,
+                'san_ip': self.san_ssh_ip
+            }
+            # Group by fields missing from the member (or null) are exported empty
+            labels.update({k: str(member[k]) if member.get(k) is not None else '' for k in groupby})
+            for field, value in member.items():
+                if field in groupby:
+                    continue
+                name = SYSTEM_REPORTER_FIELDS.get(field)
+                if isinstance(value, dict):
+                    values = {(name or field + '_{}').format(k): v for k, v in value.items()}
+                else:
+                    values = {name or field: value}
+                for name, value in values.items():
+                    if not isinstance(value, (int, float)):
+                        continue
+                    stats.append({
+                        'name': 'san_{}_{}'.format(section, name),
+                        'labels': labels,
+                        'description': '{} {} from System Reporter'.format(section, name),
+                        'value': value
+                    })
+        return stats
+
     """
-    This func converts the alert format of HPE 3Par version 3.3.1.410
+    These funcs convert the alert format of HPE 3Par version 3.3.1.410
     """
 
     def _gen_alert_key(self, k):
         alert_key = {
-            # "Id": 'alert_id',
-            # "Message Code": 'message_code',
-            # "Time": 'starts_at',
-            # "Severity": 'extra_infor',
+            "Id": 'alert_id',
+            "Message Code": 'message_code',
+            "MessageCode": 'message_code',
+            "Time": 'time',
+            "Severity": 'severity',
             "Message": 'log_content',
         }
         return alert_key.get(k, "Invalid key")
 
     def parse_alert(self, raw_alert, system_info):
-        alert = []
-        temp = {}
+        """
+        Parse the output of showalert into alert records keyed by alert id.
+        The alerts which were seen in the previous cycles are not parsed again.
+        """
+        alerts = {}
+        alert = None
         for kv in raw_alert:
-            kv_split = kv.split(':')
-            if len(kv_split) > 1:
-                k = kv_split[0].strip()
-                k = self._gen_alert_key(k)
-                v = kv_split[1].strip()
-                if k == 'log_content':
-                    temp['log_content'] = kv[14:]
-                    temp['backend_name'] = self.backend_name
-                    temp['san_ip'] = system_info['IPv4Addr']
-                    alert.append(temp)
-                    temp = {}
-                elif k != 'Invalid key':
-                    temp[k] = v
-        return alert
-
-    def run(self):  # noqa: C901
+            kv_split = kv.split(':', 1)
+            if len(kv_split) < 2:
+                continue
+            k = self._gen_alert_key(kv_split[0].strip())
+            v = kv_split[1].strip()
+            if k == 'alert_id':
+                if v in self.alerts:
+                    alerts[v] = self.alerts[v]
+                    alert = None
+                else:
+                    alert = {
+                        'alert_id': v,
+                        'backend_name': self.backend_name,
+                        'san_ip': system_info['IPv4Addr']
+                    }
+                    alerts[v] = alert
+            elif alert is not None and k != 'Invalid key':
+                alert[k] = v
+
+        new_alerts = len(alerts.keys() - self.alerts.keys())
+        resolved_alerts = len(self.alerts.keys() - alerts.keys())
+        if new_alerts or resolved_alerts:
+            logging.info("Backend %s: %s new alerts, %s resolved alerts",
+                         self.backend_name, new_alerts, resolved_alerts)
+        self.alerts = alerts
+        return alerts
+
+    def _collect_data(self):
+        data = {}
+        system_info = self.client.getStorageSystemInfo()
+        data['system_info'] = system_info
+
+        data['pools'] = self.collect_section('pools', self._get_pools_info)
+        if self.optional_metrics.get('cpu'):
+            cpu_statistics = self.collect_section('cpu', self._get_cpu_stats)
+            data['cpu_statistics'] = cpu_statistics
+        if self.optional_metrics.get('cpg'):
+            cpg_statistics = self.collect_section('cpg', self._get_pool_stats)
+            data['cpg_statistics'] = cpg_statistics
+        if self.optional_metrics.get('port'):
+            cpg_statistics = self.collect_section('port', self._get_port_stats)
+            data['port_statistics'] = cpg_statistics
+        for section in SYSTEM_REPORTER_SECTIONS:
+            if self.optional_metrics.get(section):
+                data[section + '_statistics'] = self.collect_section(section, self._get_system_reporter_stats, section)
+
+        # Run all the CLI commands of this cycle over the same SSH connection
+        cli_commands = []
+        if self.optional_metrics.get('alert'):
+            cli_commands.append('showalert')
+        cli_outputs = self.ssh_session.run_commands(cli_commands)
+
+        # Get all new alerts
+        if self.optional_metrics.get('alert'):
+            alert_list = self.parse_alert(cli_outputs['showalert'], system_info)
+            data['alert_list'] = alert_list
+
+        return data
+
+    def run(self):
         self.client = self._create_client()
         while True:
 
             try:
                 if time() - self.time_last_request > self.timeout:
+                    # Release the session while nobody is scraping this backend
+                    if self.has_session():
+                        self.client_logout()
+                    self.ssh_session.close()
                     sleep(self.interval)
                     continue
-                self.client_login()
-                data = {}
-                system_info = self.client.getStorageSystemInfo()
-                data['system_info'] = system_info
-
-                data['pools'] = []
-
-                if self.get_all_pools:
-                    pools = self.client.getCPGs()
-                    if len(pools['members']):
-                        for p in pools['members']:
-                            pool_stats = self._get_pool_info(p)
-                            data['pools'].append(pool_stats)
-
-                else:
-                    pool_name_list = self.config['pools'].split(',')
-                    for pool_name in pool_name_list:
-                        pool_name = pool_name.strip()
-                        self.client.getVolumes()
-                        p = self.client.getCPG(pool_name)
-                        pool_stats = self._get_pool_info(p)
-                        data['pools'].append(pool_stats)
-                if self.optional_metrics.get('cpu'):
-                    cpu_statistics = self._get_cpu_stats()
-                    data['cpu_statistics'] = cpu_statistics
-                if self.optional_metrics.get('cpg'):
-                    cpg_statistics = self._get_pool_stats()
-                    data['cpg_statistics'] = cpg_statistics
-                if self.optional_metrics.get('port'):
-                    cpg_statistics = self._get_port_stats()
-                    data['port_statistics'] = cpg_statistics
-
-                # Get all new alerts
-                if self.optional_metrics.get('alert'):
-                    alert_raw = self.client._run(['showalert'])
-                    alert_list = self.parse_alert(alert_raw, system_info)
-                    data['alert_list'] = alert_list
+                if not self.collect_allowed():
+                    sleep(self.interval)
+                    continue
+                # A session rejected during the cycle is recreated by the
+                # client itself
+                self.ensure_session()
+                data = self._collect_data()
+                self.session_last_used = time()
+                data['login_count'] = self.login_count
 
                 # Caching data to file using pickle
                 cache_data(self.cache_file, data)
+                self.collect_succeeded()
 
             except BaseException:
-                logging.error('Error: ', exc_info=True)
-            finally:
-                self.client_logout()
+                self.collect_failed()
 
             sleep(self.interval)
 
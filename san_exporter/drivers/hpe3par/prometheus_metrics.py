@@ -64,6 +64,9 @@ class HPE3ParMetrics(base_driver.Metrics):
                                                  _labels, registry=self.registry)
         self.gauge_san_failed_capacity_mib = Gauge('san_failedCapacityMiB', 'Total failed capacity in MiB',
                                                    _labels, registry=self.registry)
+        self.gauge_san_wsapi_session_logins = Gauge('san_wsapi_session_logins',
+                                                    'Number of WSAPI session logins since the exporter started',
+                                                    _labels, registry=self.registry)
         self.define_pool_info_metrics()
         if self.optional_metrics.get('cpu'):
             self.define_cpu_metrics()
@@ -71,9 +74,14 @@ class HPE3ParMetrics(base_driver.Metrics):
             self.define_pool_statistics_metrics()
         if self.optional_metrics.get('port'):
             self.define_port_statistics_metrics()
+        # System Reporter metrics (vlun, pd, qos, remotecopy) are defined while parsing,
+        # their labels depend on the configured group by
+        self.system_reporter_metrics = {}
         if self.optional_metrics.get('alert'):
-            alert_labels = ['log_content', 'backend_name', 'san_ip']
-            self.alert_metric = Gauge('san_alert', 'SAN Alert', alert_labels, registry=self.registry)
+            self.alert_labels = ['alert_id', 'message_code', 'severity', 'log_content', 'backend_name', 'san_ip']
+            self.alert_metric = Gauge('san_alert', 'SAN Alert', self.alert_labels, registry=self.registry)
+            # Exported alerts: alert id -> label values
+            self.alerts = {}
 
     def _check_license_enabled(self, valid_licenses, license_to_check, capability):
         """Check a license against valid licenses on the array."""
@@ -336,13 +344,33 @@ class HPE3ParMetrics(base_driver.Metrics):
                                                     slot=slot, card=card) \
                 .set(port['queueLength'])
 
-    def parse_alert_metric(self, alert_list):
-        for alert in alert_list:
-            labels = alert
-            self.alert_metric.labels(**labels).set(1)
+    def parse_system_reporter_metrics(self, stats):
+        for value in stats:
+            name = value['name']
+            labels = value['labels']
+            if name not in self.system_reporter_metrics:
+                metric = Gauge(name, value['description'], labels.keys(), registry=self.registry)
+                self.system_reporter_metrics[name] = metric
+            self.system_reporter_metrics[name].labels(**labels).set(value['value'])
+
+    def parse_alert_metric(self, alerts):
+        # Only the resolved, new and changed (e.g. severity, state) alerts are updated
+        for alert_id in self.alerts.keys() - alerts.keys():
+            self.alert_metric.remove(*self.alerts.pop(alert_id))
+        for alert_id, alert in alerts.items():
+            labelvalues = tuple(str(alert.get(label, '')) for label in self.alert_labels)
+            previous = self.alerts.get(alert_id)
+            if previous == labelvalues:
+                continue
+            if previous:
+                self.alert_metric.remove(*previous)
+            self.alert_metric.labels(*labelvalues).set(1)
+            self.alerts[alert_id] = labelvalues
 
     def parse_metrics(self, data):
         self.parse_system_info(data['system_info'])
+        self.gauge_san_wsapi_session_logins.labels(backend_name=self.backend_name, san_ip=self.san_ip) \
+            .set(data.get('login_count', 0))
         if len(data['pools']):
             for pool_info in data['pools']:
                 self.parse_pool_info(pool_info)
@@ -352,8 +380,13 @@ class HPE3ParMetrics(base_driver.Metrics):
             self.parse_pool_statistics(data['cpg_statistics'])
         if self.optional_metrics.get('port'):
             self.parse_port_statistics(data['port_statistics'])
+        # The top-N objects can change between two cycles
+        for metric in self.system_reporter_metrics.values():
+            metric._metrics.clear()
+        for section in ['vlun', 'pd', 'qos', 'remotecopy']:
+            if self.optional_metrics.get(section):
+                self.parse_system_reporter_metrics(data[section + '_statistics'])
         if self.optional_metrics.get('alert'):
-            self.alert_metric._metrics.clear()
             self.parse_alert_metric(data['alert_list'])
 
     def get_metrics(self):
@@ -0,0 +1,95 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import logging
+import socket
+
+import paramiko
+
+SSH_CONNECT_TIMEOUT = 30
+SSH_COMMAND_TIMEOUT = 60
+SSH_KEEPALIVE_INTERVAL = 30
+
+
+class HPE3ParSSHSession(object):
+    """
+    Long-lived SSH connection to run 3PAR CLI commands.
+
+    Every command runs on its own channel of the same transport, so several
+    commands per cycle only pay for one TCP/SSH handshake and authentication.
+    """
+
+    def __init__(self, ip, username, password, port=22,
+                 conn_timeout=SSH_CONNECT_TIMEOUT, command_timeout=SSH_COMMAND_TIMEOUT):
+        self.ip = ip
+        self.port = port
+        self.username = username
+        self.password = password
+        self.conn_timeout = conn_timeout
+        self.command_timeout = command_timeout
+        self.ssh = None
+
+    def is_active(self):
+        transport = self.ssh.get_transport() if self.ssh else None
+        return transport is not None and transport.is_active()
+
+    def open(self):
+        """Open the SSH connection if there is no active one"""
+        if self.is_active():
+            return
+        self.close()
+        logging.debug("Opening SSH connection to 3PAR: %s", self.ip)
+        ssh = paramiko.SSHClient()
+        ssh.load_system_host_keys()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(self.ip, port=self.port, username=self.username, password=self.password,
+                    timeout=self.conn_timeout, look_for_keys=False, allow_agent=False)
+        ssh.get_transport().set_keepalive(SSH_KEEPALIVE_INTERVAL)
+        self.ssh = ssh
+
+    def close(self):
+        if self.ssh:
+            self.ssh.close()
+            self.ssh = None
+
+    def _execute(self, cmd):
+        stdin, stdout, stderr = self.ssh.exec_command(cmd, timeout=self.command_timeout)
+        try:
+            output = stdout.read().decode()
+            exit_status = stdout.channel.recv_exit_status()
+        finally:
+            stdout.channel.close()
+        if exit_status > 0:
+            logging.warning("3PAR command '%s' exited with status %s", cmd, exit_status)
+        return output.splitlines()
+
+    def run(self, cmd):
+        """Run a CLI command and return its output lines, reconnect once if the connection was lost"""
+        self.open()
+        try:
+            return self._execute(cmd)
+        except socket.timeout:
+            logging.error("3PAR command '%s' timed out after %ss", cmd, self.command_timeout)
+            raise
+        except (paramiko.SSHException, EOFError, socket.error) as ex:
+            logging.warning("SSH connection to 3PAR %s was lost (%s), reconnecting", self.ip, ex)
+            self.close()
+            self.open()
+            return self._execute(cmd)
+
+    def run_commands(self, commands):
+        """Run several CLI commands over the same connection"""
+        return {cmd: self.run(cmd) for cmd in commands}
@@ -21,9 +21,11 @@ Reference: https://github.com/enix/hpmsa_exporter
 
 __author__ = "daikk115"
 
+import copy
 import datetime
 import hashlib
 import logging
+from collections import OrderedDict
 from time import sleep, time
 import requests
 import lxml.etree
@@ -34,6 +36,18 @@ from san_exporter.drivers.hpmsa import prometheus_metrics
 
 PREFIX = 'san_'
 
+# Time format used by the "show events from <time> to <time>" API
+EVENT_TIME_FORMAT = '%m%d%y%H%M%S'
+# Look back window of the first alert collection and maximum age of the
+# kept alerts, in seconds
+ALERT_LOOKBACK_SECONDS = 10000000
+# Overlap of two consecutive alert collections, in seconds of the array clock
+ALERT_CURSOR_OVERLAP_SECONDS = 60
+# Number of alerts kept in memory for each backend
+ALERT_WINDOW_SIZE = 100
+# Time of a response on the array, in the status object of every response
+ARRAY_TIME_SELECTOR = './OBJECT[@name="status"]/PROPERTY[@name="time-stamp-numeric"]'
+
 CONTROLLER_PROPERTIES_AS_LABEL_MAPPING = {'durable-id': 'controller'}
 SYSTEM_PROPERTIES_AS_LABEL_MAPPING = {'system-name': 'name'}
 SYSTEMHEATH_PROPERTIES_AS_LABEL_MAPPING = {
@@ -210,7 +224,7 @@ OPTIONAL_METRICS = {
         'alert': {
             'description': 'Shows Warning, Error, and Critical events',
             'sources': {
-                'path': 'events/from/{}/to/{}/error',
+                'path': 'events/from/{}/error',
                 'object_selector': './OBJECT[@name="event"]',
                 'fixed_value': '1',
                 'properties_as_label': ALERT_PROPERTIES_AS_LABEL_MAPPING,
@@ -237,41 +251,142 @@ class HPMSAExporter(base_driver.ExporterDriver):
             'san_node_hardware_version'
         ]
 
-    def run(self):  # noqa: C901
+        # Every backend owns its metric table, so changes made while
+        # collecting never leak to the other HPMSA backends.
         # TODO: Inject auto reload optional metrics here!
-        global METRICS, OPTIONAL_METRICS
-        alert_path = OPTIONAL_METRICS['alert']['alert']['sources']['path']
+        self.metrics = copy.deepcopy(METRICS)
+        for opt, enabled in self.optional_metrics.items():
+            if enabled and opt in OPTIONAL_METRICS:
+                self.metrics.update(copy.deepcopy(OPTIONAL_METRICS[opt]))
+
+        # Alerts are collected incrementally: only events newer than the
+        # cursor are requested and the last alerts are kept in memory.
+        self.alert_metric = self.metrics.pop('alert', None)
+        self.alert_window = OrderedDict()
+        self.alert_window_size = config.get('alert_window_size',
+                                            ALERT_WINDOW_SIZE)
+        self.alert_lookback = config.get('alert_lookback',
+                                         ALERT_LOOKBACK_SECONDS)
+        self.event_cursor = None
+
+    def _create_session(self):
+        session = requests.Session()
+        session.verify = False
+
+        creds = hashlib.md5(b'%s_%s' % (self.login.encode(
+            'utf8'), self.password.encode('utf8'))).hexdigest()
+        response = session.get(
+            'https://%s/api/login/%s' %
+            (self.host, creds), timeout=self.interval)
+        response.raise_for_status()
+        session_key = ET.fromstring(response.content)[0][2].text
+
+        session.headers['sessionKey'] = session_key
+        session.cookies['wbisessionkey'] = session_key
+        session.cookies['wbiusername'] = self.login
+        return session
+
+    def _show(self, session, path):
+        response = session.get(
+            'https://%s/api/show/%s' %
+            (self.host, path), timeout=self.interval)
+        response.raise_for_status()
+        return lxml.etree.fromstring(response.content)
+
+    def _parse_object(self, source, obj):
+        labels = {source['properties_as_label'][elem.get('name')]: elem.text for elem in obj
+                  if elem.get('name') in source.get('properties_as_label', {})}
+        labels.update(source.get('labels', {}))
+        if source.get('fixed_value', None):
+            value = source.get('fixed_value')
+        else:
+            value = obj.find(
+                source['property_selector']).text
+
+        if source.get('multiple_with_property', None):
+            if obj.find(source['multiple_with_property']):
+                # For HPMSA 2050
+                value = int(value) * int(
+                    obj.find(source['multiple_with_property']).text)
+            else:
+                # For HPMSA 2040
+                blocksize = obj.find(
+                    source['property_selector']).attrib['units'].replace(
+                    "blocks", "")
+                value = int(value) * int(blocksize)
+        labels.update({"san_ip": self.host})
+        return labels, value
+
+    def _collect_alerts(self, session):
+        # The requests are in UTC and the cursor follows the clock of the
+        # array, the clock of the exporter is only used by the first request.
+        if self.event_cursor is None:
+            timefrom = time() - self.alert_lookback
+        else:
+            # Overlap with the previous request a little bit, events which
+            # were already seen are skipped by their id.
+            timefrom = self.event_cursor - ALERT_CURSOR_OVERLAP_SECONDS
+        source = self.alert_metric['sources']
+        path = source['path'].format(datetime.datetime.fromtimestamp(
+            timefrom, datetime.timezone.utc).strftime(EVENT_TIME_FORMAT))
+        logging.debug(path)
+        xml = self._show(session, path)
+        # Time of the response on the array, the cursor advances to it even
+        # when no event is reported
+        array_time = xml.findtext(ARRAY_TIME_SELECTOR)
+        if array_time:
+            self.event_cursor = max(self.event_cursor or 0, int(array_time))
+
+        new_events = []
+        for obj in xml.xpath(source['object_selector']):
+            labels, value = self._parse_object(source, obj)
+            event_id = obj.findtext('./PROPERTY[@name="event-id"]')
+            if not event_id:
+                event_id = tuple(sorted(labels.items()))
+            timestamp = obj.findtext('./PROPERTY[@name="time-stamp-numeric"]')
+            if timestamp:
+                timestamp = int(timestamp)
+                self.event_cursor = max(self.event_cursor or 0, timestamp)
+            if event_id in self.alert_window:
+                continue
+            new_events.append((timestamp, event_id, {
+                'name': PREFIX + 'alert',
+                'labels': labels,
+                'type': self.alert_metric.get('type', 'gauge'),
+                'description': self.alert_metric['description'],
+                'value': value
+            }))
+
+        # The events without time are aged from their collection
+        for i, (timestamp, event_id, alert) in enumerate(new_events):
+            if not timestamp:
+                logging.warning("Event %s of backend %s has no time, it is aged "
+                                "from its collection", event_id, self.backend_name)
+                new_events[i] = (self.event_cursor or int(time()), event_id, alert)
+        # The array returns the newest events first, keep the window in
+        # chronological order so that the oldest alerts are dropped first.
+        for timestamp, event_id, alert in sorted(new_events, key=lambda e: e[0]):
+            self.alert_window[event_id] = (timestamp, alert)
+        if self.event_cursor:
+            oldest = self.event_cursor - self.alert_lookback
+            for event_id, (timestamp, _) in list(self.alert_window.items()):
+                if timestamp < oldest:
+                    del self.alert_window[event_id]
+        while len(self.alert_window) > self.alert_window_size:
+            self.alert_window.popitem(last=False)
+
+        return [alert for _, alert in self.alert_window.values()]
+
+    def run(self):  # noqa: C901
         while True:
             if time() - self.time_last_request > self.timeout:
                 sleep(self.interval)
                 continue
-            # Prepare the list of metrics which are we need to be collected
-            # Firstly, we need some update for metric list
-            timeto = datetime.datetime.now()
-            timefrom = datetime.datetime.now() - datetime.timedelta(seconds=10000000)
-            OPTIONAL_METRICS['alert']['alert']['sources']['path'] = alert_path.format(
-                timefrom.strftime('%m%d%y%H%M%S'), timeto.strftime('%m%d%y%H%M%S'))
-            logging.info(OPTIONAL_METRICS['alert']['alert']['sources']['path'])
-            for opt, enabled in self.optional_metrics.items():
-                if not enabled:
-                    continue
-                for k, v in OPTIONAL_METRICS[opt].items():
-                    METRICS[k] = v
+            if not self.collect_allowed():
+                sleep(self.interval)
+                continue
             try:
-                session = requests.Session()
-                session.verify = False
-
-                creds = hashlib.md5(b'%s_%s' % (self.login.encode(
-                    'utf8'), self.password.encode('utf8'))).hexdigest()
-                response = session.get(
-                    'https://%s/api/login/%s' %
-                    (self.host, creds), timeout=self.interval)
-                response.raise_for_status()
-                session_key = ET.fromstring(response.content)[0][2].text
-
-                session.headers['sessionKey'] = session_key
-                session.cookies['wbisessionkey'] = session_key
-                session.cookies['wbiusername'] = self.login
+                session = self._create_session()
 
                 path_cache = {}
                 data_cache = {
@@ -279,7 +394,7 @@ class HPMSAExporter(base_driver.ExporterDriver):
                     'metrics': []
                 }
 
-                for name, metric in METRICS.items():
+                for name, metric in self.metrics.items():
                     name = PREFIX + name
                     if isinstance(metric['sources'], dict):
                         sources = [metric['sources']]
@@ -288,37 +403,13 @@ class HPMSAExporter(base_driver.ExporterDriver):
 
                     for source in sources:
                         if source['path'] not in path_cache:
-                            response = session.get(
-                                'https://%s/api/show/%s' %
-                                (self.host, source['path']), timeout=self.interval)
-                            response.raise_for_status()
-                            path_cache[source['path']] = lxml.etree.fromstring(
-                                response.content)
+                            path_cache[source['path']] = self._show(
+                                session, source['path'])
 
                         xml = path_cache[source['path']]
 
                         for obj in xml.xpath(source['object_selector']):
-                            labels = {source['properties_as_label'][elem.get('name')]: elem.text for elem in obj
-                                      if elem.get('name') in source.get('properties_as_label', {})}
-                            labels.update(source.get('labels', {}))
-                            if source.get('fixed_value', None):
-                                value = source.get('fixed_value')
-                            else:
-                                value = obj.find(
-                                    source['property_selector']).text
-
-                            if source.get('multiple_with_property', None):
-                                if obj.find(source['multiple_with_property']):
-                                    # For HPMSA 2050
-                                    value = int(value) * int(
-                                        obj.find(source['multiple_with_property']).text)
-                                else:
-                                    # For HPMSA 2040
-                                    blocksize = obj.find(
-                                        source['property_selector']).attrib['units'].replace(
-                                        "blocks", "")
-                                    value = int(value) * int(blocksize)
-                            labels.update({"san_ip": self.host})
+                            labels, value = self._parse_object(source, obj)
 
                             if name in self.info_metrics:
                                 data_cache['info_metrics'][name] = value
@@ -330,9 +421,14 @@ class HPMSAExporter(base_driver.ExporterDriver):
                                     'description': metric['description'],
                                     'value': value
                                 })
+
+                if self.alert_metric:
+                    data_cache['metrics'] += self._collect_alerts(session)
+
                 cache_data(self.cache_file, data_cache)
+                self.collect_succeeded()
             except BaseException:
-                logging.error('Error: ', exc_info=True)
+                self.collect_failed()
 
             sleep(self.interval)
 
@@ -47,6 +47,10 @@ class HPMSAMetrics(base_driver.Metrics):
 
     def parse_metrics(self, data):
         self.parse_system_info(data['info_metrics'])
+        # Clear every metric once, a metric (e.g. san_alert) can have
+        # several label sets in the same cache
+        for metric in self.metrics.values():
+            metric._metrics.clear()
         for value in data['metrics']:
             name = value['name']
             labels = value['labels']
@@ -58,7 +62,6 @@ class HPMSAMetrics(base_driver.Metrics):
                     labels.keys(),
                     registry=self.registry)
                 self.metrics[name] = metric
-            self.metrics[name]._metrics.clear()
             if name in {
                 'san_pool_free_capacity_mib',
                     'san_pool_total_capacity_mib'}:
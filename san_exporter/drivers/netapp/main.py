@@ -16,13 +16,22 @@
 #    under the License.
 #
 
-from time import sleep
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
 
-import requests
 from san_exporter.drivers import base_driver
 from san_exporter.drivers.netapp import prometheus_metrics
+from san_exporter.utils.http_client import create_http_client
 from san_exporter.utils.utils import cache_data
 
+# Number of records of a page of ONTAP collections
+MAX_RECORDS = 1000
+METRIC_FIELDS = 'metric.iops,metric.latency,metric.throughput,metric.status'
+# Default maximum number of volumes/LUNs exported
+MAX_OBJECTS = 1000
+PERF_DIRECTIONS = ['read', 'write', 'other']
+
 
 class NetAppExporter(base_driver.ExporterDriver):
     def __init__(self, config=None, interval=10):
@@ -34,11 +43,33 @@ class NetAppExporter(base_driver.ExporterDriver):
         self.backend_name = config['name']
         self.auth = (self.netapp_username, self.netapp_password)
         self.headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+        self.base_url = 'https://' + self.netapp_api_ip
+        self.session = create_http_client(self.backend_name, self.http_config,
+                                          pool_maxsize=self.max_workers)
+
+    def get(self, path, params=None):
+        response = self.session.get(self.base_url + path, params=params, headers=self.headers,
+                                    auth=self.auth, verify=False)
+        response.raise_for_status()
+        return response.json()
+
+    def get_records(self, path, params=None):
+        """Yield the records of an ONTAP collection, following the next page links"""
+        params = dict(params or {})
+        params.setdefault('max_records', MAX_RECORDS)
+        response = self.get(path, params)
+        while True:
+            for record in response.get('records', []):
+                yield record
+            next_link = response.get('_links', {}).get('next')
+            if not next_link:
+                break
+            # The next link already contains the query of the collection
+            response = self.get(next_link['href'])
 
     def get_cluster_metrics(self):
         cluster_data = []
-        response = requests.get('https://' + self.netapp_api_ip + '/api/cluster', headers=self.headers, auth=self.auth,
-                                verify=False).json()
+        response = self.get('/api/cluster', {'fields': 'name,version,' + METRIC_FIELDS})
         cluster_metric = {'name': response['name'], 'version': response['version']['full'],
                           'read_iops': response['metric']['iops']['read'],
                           'write_iops': response['metric']['iops']['write'],
@@ -57,10 +88,7 @@ class NetAppExporter(base_driver.ExporterDriver):
 
     def get_node_info(self):
         node_data = []
-        response = requests.get(
-            'https://' + self.netapp_api_ip + '/api/cluster/nodes?fields=name,serial_number,state,model,version',
-            headers=self.headers, auth=self.auth, verify=False).json()
-        for t in response['records']:
+        for t in self.get_records('/api/cluster/nodes', {'fields': 'name,serial_number,state,model,version'}):
             data = {'name': t['name'], 'state': t['state'], 'model': t['model'], 'serial_number': t['serial_number'],
                     'version': t['version']['full']}
             data.update({'san_ip': self.netapp_api_ip})
@@ -69,42 +97,129 @@ class NetAppExporter(base_driver.ExporterDriver):
 
     def get_pool_info(self):
         pool_data = []
-        response = pool_info = requests.get(
-            'https://' + self.netapp_api_ip + "/api/storage/volumes?fields=metric,state,space", headers=self.headers,
-            auth=self.auth, verify=False).json()
-        for t in response['records']:
-            if t['name'].startswith('agg'):
-                data = {'name': t['name'], 'size_total': t['space']['available'], 'size_used': t['space']['used'],
-                        'read_iops': t['metric']['iops']['read'], 'write_iops': t['metric']['iops']['write'],
-                        'other_iops': t['metric']['iops']['other'], 'read_latency': t['metric']['latency']['read'],
-                        'write_latency': t['metric']['latency']['write'],
-                        'other_latency': t['metric']['latency']['other'],
-                        'read_throughput': t['metric']['throughput']['read'],
-                        'write_throughput': t['metric']['throughput']['write'],
-                        'other_throughput': t['metric']['throughput']['other'], 'status': t['metric']['status']}
-                data.update({'san_ip': self.netapp_api_ip})
-                pool_data.append(data)
+        params = {'fields': 'name,space.block_storage,' + METRIC_FIELDS}
+        if not self.get_all_pools:
+            # ONTAP query: aggregate names separated by "|"
+            params['name'] = '|'.join(pool.strip() for pool in self.config['pools'].split(','))
+        for t in self.get_records('/api/storage/aggregates', params):
+            space = t['space']['block_storage']
+            data = {'name': t['name'], 'size_total': space['available'], 'size_used': space['used'],
+                    'read_iops': t['metric']['iops']['read'], 'write_iops': t['metric']['iops']['write'],
+                    'other_iops': t['metric']['iops']['other'], 'read_latency': t['metric']['latency']['read'],
+                    'write_latency': t['metric']['latency']['write'],
+                    'other_latency': t['metric']['latency']['other'],
+                    'read_throughput': t['metric']['throughput']['read'],
+                    'write_throughput': t['metric']['throughput']['write'],
+                    'other_throughput': t['metric']['throughput']['other'], 'status': t['metric']['status']}
+            data.update({'san_ip': self.netapp_api_ip})
+            pool_data.append(data)
         return pool_data
 
     def get_disk_info(self):
         disk_data = []
-        response = requests.get(
-            'https://' + self.netapp_api_ip + '/api/storage/disks?fields=name,state,model,serial_number',
-            headers=self.headers, auth=self.auth, verify=False).json()
-        for t in response['records']:
+        for t in self.get_records('/api/storage/disks', {'fields': 'name,state,model,serial_number'}):
             data = {'name': t['name'], 'state': t['state'], 'model': t['model'], 'serial_number': t['serial_number']}
             data.update({'san_ip': self.netapp_api_ip})
             disk_data.append(data)
         return disk_data
 
+    def get_perf(self, record):
+        perf = {}
+        for direction in PERF_DIRECTIONS:
+            perf[direction + '_iops'] = record['metric']['iops'][direction]
+            perf[direction + '_latency'] = record['metric']['latency'][direction]
+            perf[direction + '_throughput'] = record['metric']['throughput'][direction]
+        return perf
+
+    def get_objects_perf(self, path, object_filter):
+        """Yield name, SVM and performance of the volumes/LUNs matching the filter"""
+        params = {'fields': 'name,svm.name,' + METRIC_FIELDS}
+        # ONTAP queries, e.g. name=vol_* or svm.name=svm1|svm2
+        if object_filter.get('name'):
+            params['name'] = object_filter['name']
+        if object_filter.get('svm'):
+            params['svm.name'] = object_filter['svm']
+        for t in self.get_records(path, params):
+            if 'metric' not in t:
+                continue
+            data = {'name': t['name'], 'svm': t['svm']['name'], 'san_ip': self.netapp_api_ip}
+            data.update(self.get_perf(t))
+            yield data
+
+    def limit_objects(self, objects, object_type, max_count):
+        limited = []
+        for data in objects:
+            if len(limited) >= max_count:
+                logging.warning("Backend %s has more than %s %ss, only the first ones are exported",
+                                self.backend_name, max_count, object_type)
+                break
+            limited.append(data)
+        return limited
+
+    def rollup_svms(self, volumes):
+        """Sum the performance of the volumes of each SVM, latencies are weighted by IOPS"""
+        svms = {}
+        for volume in volumes:
+            svm = svms.setdefault(volume['svm'], {'name': volume['svm'], 'san_ip': self.netapp_api_ip})
+            for direction in PERF_DIRECTIONS:
+                for key in ('_iops', '_throughput'):
+                    svm[direction + key] = svm.get(direction + key, 0) + volume[direction + key]
+                svm[direction + '_latency'] = svm.get(direction + '_latency', 0) + \
+                    volume[direction + '_latency'] * volume[direction + '_iops']
+        for svm in svms.values():
+            for direction in PERF_DIRECTIONS:
+                iops = svm[direction + '_iops']
+                svm[direction + '_latency'] = svm[direction + '_latency'] / iops if iops else 0
+        return list(svms.values())
+
+    def get_volume_and_svm_metrics(self):
+        volume_filter = self.config.get('volume_filter', {})
+        volumes = self.get_objects_perf('/api/storage/volumes', volume_filter)
+        if not self.optional_metrics.get('svm'):
+            return {'volume': self.limit_objects(volumes, 'volume', volume_filter.get('max_count', MAX_OBJECTS))}
+        # The SVM rollup needs every volume, only the exported ones are kept
+        volumes = list(volumes)
+        data = {'svm': self.rollup_svms(volumes)}
+        if self.optional_metrics.get('volume'):
+            data['volume'] = self.limit_objects(volumes, 'volume', volume_filter.get('max_count', MAX_OBJECTS))
+        return data
+
+    def get_lun_metrics(self):
+        lun_filter = self.config.get('lun_filter', {})
+        luns = self.get_objects_perf('/api/storage/luns', lun_filter)
+        return self.limit_objects(luns, 'LUN', lun_filter.get('max_count', MAX_OBJECTS))
+
+    def get_collectors(self):
+        collectors = {'cluster': self.get_cluster_metrics}
+        if self.optional_metrics.get('node'):
+            collectors['node'] = self.get_node_info
+        if self.optional_metrics.get('pool'):
+            collectors['pool'] = self.get_pool_info
+        if self.optional_metrics.get('disk'):
+            collectors['disk'] = self.get_disk_info
+        if self.optional_metrics.get('lun'):
+            collectors['lun'] = self.get_lun_metrics
+        if self.optional_metrics.get('volume') or self.optional_metrics.get('svm'):
+            # Returns both the 'volume' and 'svm' sections
+            collectors['volume_svm'] = self.get_volume_and_svm_metrics
+        return collectors
+
     def run(self):
         while True:
-            data = {}
-            data['cluster'] = self.get_cluster_metrics()
-            data['node'] = self.get_node_info()
-            data['pool'] = self.get_pool_info()
-            data['disk'] = self.get_disk_info()
-            cache_data(self.cache_file, data)
+            if time() - self.time_last_request > self.timeout or not self.collect_allowed():
+                sleep(self.interval)
+                continue
+            try:
+                # The endpoints are independent, fetch them concurrently
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = {name: executor.submit(self.collect_section, name, collector)
+                               for name, collector in self.get_collectors().items()}
+                    data = {name: future.result() for name, future in futures.items()}
+                data.update(data.pop('volume_svm', {}))
+                cache_data(self.cache_file, data)
+                self.collect_succeeded()
+            except Exception:
+                self.collect_failed("Error while collecting NetApp metrics of backend: %s")
             sleep(self.interval)
 
 
@@ -36,6 +36,14 @@ class NetAppMetrics(base_driver.Metrics):
             self.define_node_metrics()
         if self.optional_metrics.get('disk'):
             self.define_disk_metrics()
+        # Performance of volumes, LUNs and SVMs: section -> [(gauge, field, divisor)]
+        self.perf_metrics = {}
+        if self.optional_metrics.get('volume'):
+            self.define_perf_metrics('volume', 'Volume', ['backend_name', 'san_ip', 'volume_name', 'svm_name'])
+        if self.optional_metrics.get('lun'):
+            self.define_perf_metrics('lun', 'LUN', ['backend_name', 'san_ip', 'lun_name', 'svm_name'])
+        if self.optional_metrics.get('svm'):
+            self.define_perf_metrics('svm', 'SVM', ['backend_name', 'san_ip', 'svm_name'])
 
     def define_cluster_info(self):
         cluster_labels = ["name", "backend_name", "san_ip", "version"]
@@ -197,6 +205,35 @@ class NetAppMetrics(base_driver.Metrics):
             state = 0
         self.gauge_san_disk_state.labels(backend_name=self.backend_name, san_ip=disk['san_ip'], name=name).set(state)
 
+    def define_perf_metrics(self, section, description, labels):
+        metrics = []
+        for direction in ['read', 'write', 'other']:
+            title = direction.capitalize()
+            metrics.append((Gauge('san_%s_number_%s_io' % (section, direction),
+                                  '%s %s IOPS' % (description, title),
+                                  labels, registry=self.registry), direction + '_iops', 1))
+            metrics.append((Gauge('san_%s_number_%s_latency' % (section, direction),
+                                  '%s %s Latency - us' % (description, title),
+                                  labels, registry=self.registry), direction + '_latency', 1))
+            metrics.append((Gauge('san_%s_number_%s_byte_rate' % (section, direction),
+                                  '%s %s Throughput - KiB/s' % (description, title),
+                                  labels, registry=self.registry), direction + '_throughput', 1024))
+        self.perf_metrics[section] = metrics
+
+    def parse_perf_metrics(self, section, objects):
+        metrics = self.perf_metrics[section]
+        # Removed or filtered out objects must not be exported anymore
+        for gauge, field, divisor in metrics:
+            gauge._metrics.clear()
+        for obj in objects:
+            # Same order as the labels of the section
+            if section == 'svm':
+                labelvalues = (self.backend_name, obj['san_ip'], obj['name'])
+            else:
+                labelvalues = (self.backend_name, obj['san_ip'], obj['name'], obj['svm'])
+            for gauge, field, divisor in metrics:
+                gauge.labels(*labelvalues).set(obj[field] / divisor)
+
     def parse_metrics(self, data):
         for data_cluster in data['cluster']:
             self.parse_cluster_info(data_cluster)
@@ -215,6 +252,8 @@ class NetAppMetrics(base_driver.Metrics):
             if len(data['disk']):
                 for i in data['disk']:
                     self.parse_disk_metrics(i)
+        for section in self.perf_metrics:
+            self.parse_perf_metrics(section, data.get(section, []))
 
     def get_metrics(self):
         metrics = generate_latest(self.registry)
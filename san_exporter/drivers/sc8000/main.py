@@ -18,14 +18,26 @@
 
 import datetime
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep, time
 import json
 import requests
 
+from san_exporter.utils.http_client import create_http_client
 from san_exporter.utils.utils import cache_data
 from san_exporter.drivers import base_driver
 from san_exporter.drivers.sc8000 import prometheus_metrics
 
+# Look back window of the first GetHistoricalIoUsage request of an object
+HISTORICAL_LOOKBACK_MINUTES = 15
+DSM_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+# Name of the aggregate of the volumes dropped by the top-N selection
+OTHER_VOLUMES = 'other'
+# Summed fields of the volume IO usage, the other ones are averages
+VOLUME_RATE_FIELDS = ['readKbPerSecond', 'writeKbPerSecond',
+                      'totalKbPerSecond', 'readIops', 'writeIops', 'totalIops']
+
 
 class SC8000_Exporter(base_driver.ExporterDriver):
 
@@ -41,11 +53,20 @@ class SC8000_Exporter(base_driver.ExporterDriver):
         self.apiversion = config['apiversion']
         self.baseURL = 'https://%s:%s/api/rest/' % (self.DSM_api_ip,
                                                     self.DSM_api_port)
+        # Time of the last ingested IO usage sample of each controller/port,
+        # only the newer samples are requested
+        self.last_sample_time = {}
+        self.new_sample_time = {}
+        # Volume filters: name patterns, servers and top-N selection
+        volume_filter = config.get('volume_filter', {})
+        self.volume_include = [re.compile(pattern) for pattern in
+                               volume_filter.get('include', [])]
+        self.volume_exclude = [re.compile(pattern) for pattern in
+                               volume_filter.get('exclude', [])]
+        self.volume_servers = volume_filter.get('servers', [])
+        self.volume_top = volume_filter.get('top', 0)
+        self.volume_sort_by = volume_filter.get('sort_by', 'totalIops')
         # define HTTP content headers
-        now = datetime.datetime.now() - datetime.timedelta(minutes=15)
-        dt_string = now.strftime('%Y-%m-%dT%H:%M:%S')
-        self.payload = {'HistoricalFilter': {'FilterTime': 'Other',
-                        'StartTime': dt_string, 'UseCurrent': True}}
         self.header = {}
         self.header['Content-Type'] = 'application/json; charset=utf-8'
         self.header['Accept'] = 'application/json'
@@ -53,7 +74,10 @@ class SC8000_Exporter(base_driver.ExporterDriver):
         if not self.verify_cert:
             requests.packages.urllib3.disable_warnings()
         # define the connection session
-        self.session = requests.Session()
+        # Keep one pooled connection per worker so the concurrent requests
+        # to the DSM reuse their connections
+        self.session = create_http_client(self.backend_name, self.http_config,
+                                          pool_maxsize=self.max_workers)
         self.session.auth = (self.DSM_username, self.DSM_password)
 
     def login(self):
@@ -70,6 +94,12 @@ class SC8000_Exporter(base_driver.ExporterDriver):
         self.session.post(completeURL, headers=self.header,
                           verify=self.verify_cert)
 
+    def safe_logout(self):
+        try:
+            self.logout()
+        except Exception as ex:
+            logging.warning("Can not log out of DSM %s: %s", self.DSM_api_ip, ex)
+
     def get_info_DSM(self):
         REST = '/ApiConnection/ApiConnection'
         completeURL = '%s%s' % (self.baseURL, (REST if REST[0] != '/'
@@ -114,16 +144,42 @@ class SC8000_Exporter(base_driver.ExporterDriver):
                             {element['name']: [element['instanceId'], element['hostOrIpAddress']]})
             return list_instanceId_sc
 
+    def get_historical_payload(self, instanceId):
+        if instanceId in self.last_sample_time:
+            start_time = self.last_sample_time[instanceId] + \
+                datetime.timedelta(seconds=1)
+        else:
+            start_time = datetime.datetime.now() - \
+                datetime.timedelta(minutes=HISTORICAL_LOOKBACK_MINUTES)
+        return {'HistoricalFilter': {
+            'FilterTime': 'Other',
+            'StartTime': start_time.strftime(DSM_TIME_FORMAT),
+            'UseCurrent': True}}
+
+    def get_latest_sample(self, instanceId, samples):
+        # Only the latest sample of each object is exported
+        if not samples:
+            return []
+        latest = max(samples, key=lambda sample: sample.get('time', ''))
+        try:
+            self.new_sample_time[instanceId] = datetime.datetime.strptime(
+                latest['time'][:19], DSM_TIME_FORMAT)
+        except (KeyError, ValueError):
+            self.new_sample_time[instanceId] = datetime.datetime.now()
+        return [latest]
+
     def get_IOUsage_controller(self, instanceId_controller):
         REST = '/StorageCenter/ScController/%s/GetHistoricalIoUsage' \
             % instanceId_controller
         completeURL = '%s%s' % (self.baseURL, (REST if REST[0] != '/'
                                                else REST[1:]))
+        payload = self.get_historical_payload(instanceId_controller)
         json_data = self.session.post(completeURL,
-                                      data=json.dumps(self.payload,
+                                      data=json.dumps(payload,
                                                       ensure_ascii=False).encode('utf-8'),
                                       headers=self.header, verify=self.verify_cert)
-        return json.loads(json_data.text)
+        return self.get_latest_sample(instanceId_controller,
+                                      json.loads(json_data.text))
 
     def get_info_port(self, ID_SC):
         REST = '/StorageCenter/StorageCenter/%s/ControllerPortList' \
@@ -140,11 +196,13 @@ class SC8000_Exporter(base_driver.ExporterDriver):
             % instanceId_port
         completeURL = '%s%s' % (self.baseURL, (REST if REST[0] != '/'
                                                else REST[1:]))
+        payload = self.get_historical_payload(instanceId_port)
         json_data = self.session.post(completeURL,
-                                      data=json.dumps(self.payload,
+                                      data=json.dumps(payload,
                                                       ensure_ascii=False).encode('utf-8'),
                                       headers=self.header, verify=self.verify_cert)
-        return json.loads(json_data.text)
+        return self.get_latest_sample(instanceId_port,
+                                      json.loads(json_data.text))
 
     def get_diskfolder(self, instanceId_SC):
         REST = \
@@ -201,88 +259,170 @@ class SC8000_Exporter(base_driver.ExporterDriver):
                                      verify=self.verify_cert)
         return json.loads(json_data.text)
 
+    def get_mapping_server(self, instanceId_server):
+        REST = '/StorageCenter/ScServer/%s/MappingList' \
+            % instanceId_server
+        completeURL = '%s%s' % (self.baseURL, (REST if REST[0] != '/'
+                                               else REST[1:]))
+        json_data = self.session.get(completeURL, headers=self.header,
+                                     verify=self.verify_cert)
+        return json.loads(json_data.text)
+
+    def get_volumes_servers(self, server_sc):
+        # Names of the volumes mapped to the configured servers
+        volumes = set()
+        for server in server_sc:
+            if server['name'] not in self.volume_servers:
+                continue
+            for mapping in self.get_mapping_server(server['instanceId']):
+                volumes.add(mapping['volume']['instanceName'])
+        return volumes
+
+    def match_volume(self, name, volumes_servers):
+        if self.volume_include and \
+                not any(p.search(name) for p in self.volume_include):
+            return False
+        if any(p.search(name) for p in self.volume_exclude):
+            return False
+        if volumes_servers is not None and name not in volumes_servers:
+            return False
+        return True
+
+    def aggregate_volumes(self, volumes):
+        other = {'scName': volumes[0]['scName'],
+                 'instanceName': OTHER_VOLUMES}
+        for field in VOLUME_RATE_FIELDS:
+            other[field] = sum(volume[field] for volume in volumes)
+        # Latencies are averaged weighted by the IO rate
+        read_iops = other['readIops']
+        write_iops = other['writeIops']
+        other['readLatency'] = sum(
+            volume['readLatency'] * volume['readIops']
+            for volume in volumes) / read_iops if read_iops else 0
+        other['writeLatency'] = sum(
+            volume['writeLatency'] * volume['writeIops']
+            for volume in volumes) / write_iops if write_iops else 0
+        other['averageKbPerIo'] = other['totalKbPerSecond'] / \
+            other['totalIops'] if other['totalIops'] else 0
+        return other
+
+    def filter_volumes(self, iousage_volume, server_sc):
+        volumes_servers = None
+        if self.volume_servers:
+            volumes_servers = self.get_volumes_servers(server_sc)
+        volumes = [volume for volume in iousage_volume
+                   if self.match_volume(volume['instanceName'],
+                                        volumes_servers)]
+        if not self.volume_top or len(volumes) <= self.volume_top:
+            return volumes
+        volumes.sort(key=lambda volume: volume[self.volume_sort_by],
+                     reverse=True)
+        top = volumes[:self.volume_top]
+        top.append(self.aggregate_volumes(volumes[self.volume_top:]))
+        return top
+
+    def get_resources_SC(self, instanceId_SC):
+        resources = {}
+        resources['controller'] = self.get_info_controller(instanceId_SC)
+        resources['port'] = self.get_info_port(instanceId_SC)
+        resources['diskfolder'] = self.get_diskfolder(instanceId_SC)
+        resources['alert'] = self.get_alert(instanceId_SC)
+        resources['space_sc'] = self.get_space_sc(instanceId_SC)
+        resources['server_sc'] = self.get_server_sc(instanceId_SC)
+        resources['iousage_volume'] = self.filter_volumes(
+            self.get_IOUsage_volume(instanceId_SC), resources['server_sc'])
+        return resources
+
+    def get_data(self):
+        """Data of one collection of the DSM"""
+        self.new_sample_time = {}
+        data = {}
+        DSM_info = self.get_info_DSM()
+        data['DSM_info'] = DSM_info
+        # get info SC
+        SC_info = self.get_info_SC(DSM_info['instanceId'])
+        data['SC_info'] = SC_info
+        # map san_name to san_ip and san_id
+        list_instanceId_SC = self.get_instanceId_SC(SC_info)
+        data['SCmap_name_ip'] = list_instanceId_SC
+        info_controller = []
+        info_port = []
+        info_disk = []
+        list_instanceId_controller = []
+        map_IdtoIp_controller = {}
+        list_instanceId_port = []
+        iousage_volume = []
+        parse_alert = []
+        space_SC = []
+        server_sc = []
+        id_sc = []
+        SCmap_name_ip = {}
+        SCmap_serial_ip = {}
+        for ID in list_instanceId_SC:
+            SCmap_name_ip.update(ID)
+            SCmap_serial_ip.update(
+                {list(ID.values())[0][0]: list(ID.values())[0][1]})
+            id_sc.append(list(ID.values())[0][0])
+        # The DSM requests are sent concurrently, max_workers bounds
+        # the number of in-flight requests to the DSM
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            sc_resources = list(executor.map(self.get_resources_SC, id_sc))
+            for ID, resources in zip(list_instanceId_SC, sc_resources):
+                get_controller = resources['controller']
+                get_port = resources['port']
+                info_disk.append(resources['diskfolder'])
+                info_controller.append(
+                    {list(ID.keys())[0]: get_controller})
+                info_port.append({list(ID.keys())[0]: get_port})
+                iousage_volume.append(resources['iousage_volume'])
+                parse_alert.append(resources['alert'])
+                space_SC.append(resources['space_sc'])
+                server_sc.append(resources['server_sc'])
+                for k in get_controller:
+                    map_IdtoIp_controller.update(
+                        {k['instanceId']: k['ipAddress']})
+                    list_instanceId_controller.append(k['instanceId'])
+                for j in get_port:
+                    list_instanceId_port.append(j['instanceId'])
+            # get IOUsage SCcontroller and port
+            IOUsage_controller = list(executor.map(
+                self.get_IOUsage_controller, list_instanceId_controller))
+            IOUsage_port = list(executor.map(
+                self.get_IOUsage_port, list_instanceId_port))
+        data['SCmap_name_ip'] = SCmap_name_ip
+        data['SCmap_serial_ip'] = SCmap_serial_ip
+        data['id_sc'] = id_sc
+        data['info_controller'] = info_controller
+        data['info_port'] = info_port
+        data['info_disk'] = info_disk
+        data['iousage_volume'] = iousage_volume
+        data['get_alert'] = parse_alert
+        data['space_sc'] = space_SC
+        data['server_sc'] = server_sc
+        data['IOUsage_controller'] = IOUsage_controller
+        data['map_ipsccontroller'] = map_IdtoIp_controller
+        data['IOUsage_port'] = IOUsage_port
+        return data
+
     def run(self):
         while True:
+            if time() - self.time_last_request > self.timeout or not self.collect_allowed():
+                sleep(self.interval)
+                continue
+            logged_in = False
             try:
-                if time() - self.time_last_request > self.timeout:
-                    sleep(self.interval)
-                    continue
                 self.login()
-                data = {}
-                DSM_info = self.get_info_DSM()
-                data['DSM_info'] = DSM_info
-                # get info SC
-                SC_info = self.get_info_SC(DSM_info['instanceId'])
-                data['SC_info'] = SC_info
-                # map san_name to san_ip and san_id
-                list_instanceId_SC = self.get_instanceId_SC(SC_info)
-                data['SCmap_name_ip'] = list_instanceId_SC
-                info_controller = []
-                info_port = []
-                info_disk = []
-                list_instanceId_controller = []
-                map_IdtoIp_controller = {}
-                list_instanceId_port = []
-                iousage_volume = []
-                parse_alert = []
-                space_SC = []
-                server_sc = []
-                id_sc = []
-                SCmap_name_ip = {}
-                SCmap_serial_ip = {}
-                for ID in list_instanceId_SC:
-                    SCmap_name_ip.update(ID)
-                    SCmap_serial_ip.update(
-                        {list(ID.values())[0][0]: list(ID.values())[0][1]})
-                    id_sc.append(list(ID.values())[0][0])
-                    get_controller = \
-                        self.get_info_controller(list(ID.values())[0][0])
-                    get_port = \
-                        self.get_info_port(list(ID.values())[0][0])
-                    info_disk.append(self.get_diskfolder(
-                        list(ID.values())[0][0]))
-                    info_controller.append(
-                        {list(ID.keys())[0]: get_controller})
-                    info_port.append({list(ID.keys())[0]: get_port})
-                    iousage_volume.append(
-                        self.get_IOUsage_volume(list(ID.values())[0][0]))
-                    parse_alert.append(self.get_alert(list(ID.values())[0][0]))
-                    space_SC.append(self.get_space_sc(list(ID.values())[0][0]))
-                    server_sc.append(self.get_server_sc(
-                        list(ID.values())[0][0]))
-                    for k in get_controller:
-                        map_IdtoIp_controller.update(
-                            {k['instanceId']: k['ipAddress']})
-                        list_instanceId_controller.append(k['instanceId'])
-                    for j in get_port:
-                        list_instanceId_port.append(j['instanceId'])
-                data['SCmap_name_ip'] = SCmap_name_ip
-                data['SCmap_serial_ip'] = SCmap_serial_ip
-                data['id_sc'] = id_sc
-                data['info_controller'] = info_controller
-                data['info_port'] = info_port
-                data['info_disk'] = info_disk
-                data['iousage_volume'] = iousage_volume
-                data['get_alert'] = parse_alert
-                data['space_sc'] = space_SC
-                data['server_sc'] = server_sc
-                # get IOUsage SCcontroller
-                IOUsage_controller = []
-                for instanceId_controller in list_instanceId_controller:
-                    IOUsage_controller.append(
-                        self.get_IOUsage_controller(instanceId_controller))
-                data['IOUsage_controller'] = IOUsage_controller
-                data['map_ipsccontroller'] = map_IdtoIp_controller
-                # get IOUsage port
-                IOUsage_port = []
-                for ID_port in list_instanceId_port:
-                    IOUsage_port.append(self.get_IOUsage_port(ID_port))
-                data['IOUsage_port'] = IOUsage_port
+                logged_in = True
+                data = self.get_data()
                 cache_data(self.cache_file, data)
+                # The samples were ingested, move the windows forward
+                self.last_sample_time.update(self.new_sample_time)
+                self.collect_succeeded()
             except:
-                logging.error('Error: ', exc_info=True)
+                self.collect_failed()
             finally:
-                self.logout()
+                if logged_in:
+                    self.safe_logout()
             sleep(self.interval)
 
 
@@ -136,6 +136,22 @@ class SC8000_Metrics(base_driver.Metrics):
             Gauge('san_memory_percent_usage',
                   'Controller The percent usage of the memory', labels,
                   registry=self.registry)
+        # (gauge, field, divisor) of every IO usage sample of a controller
+        self.IOUsage_controller_metrics = [
+            (self.ReadLatency_san_controller, 'readLatency', 1000),
+            (self.WriteLatency_san_controller, 'writeLatency', 1000),
+            (self.ReadKbPerSecond_san_controller, 'readKbPerSecond', 1),
+            (self.AverageKbPerIo_san_controller, 'averageKbPerIo', 1),
+            (self.WriteKbPerSecond_san_controller, 'writeKbPerSecond', 1),
+            (self.TotalKbPerSecond_san_controller, 'totalKbPerSecond', 1),
+            (self.writeIops_san_controller, 'writeIops', 1),
+            (self.readIops_san_controller, 'readIops', 1),
+            (self.totalIops_san_controller, 'totalIops', 1),
+            (self.cpuPercentUsage_san_controller, 'cpuPercentUsage', 1),
+            (self.memoryPercentUsage_san_controller, 'memoryPercentUsage', 1),
+        ]
+        # Label values of a controller -> its child of every gauge of the table
+        self.IOUsage_controller_children = {}
 
     def define_IOUsage_port(self):
         labels = ['instanceid_port', 'san_name', 'backend_name',
@@ -176,6 +192,20 @@ class SC8000_Metrics(base_driver.Metrics):
             Gauge('san_port_number_total_io',
                   'Port Total I/O Rate - ops/s', labels,
                   registry=self.registry)
+        # (gauge, field, divisor) of every IO usage sample of a port
+        self.IOUsage_port_metrics = [
+            (self.ReadLatency_san_port, 'readLatency', 1000),
+            (self.WriteLatency_san_port, 'writeLatency', 1000),
+            (self.ReadKbPerSecond_san_port, 'readKbPerSecond', 1),
+            (self.AverageKbPerIo_san_port, 'averageKbPerIo', 1),
+            (self.WriteKbPerSecond_san_port, 'writeKbPerSecond', 1),
+            (self.TotalKbPerSecond_san_port, 'totalKbPerSecond', 1),
+            (self.writeIops_san_port, 'writeIops', 1),
+            (self.readIops_san_port, 'readIops', 1),
+            (self.totalIops_san_port, 'totalIops', 1),
+        ]
+        # Label values of a port -> its child of every gauge of the table
+        self.IOUsage_port_children = {}
 
     def define_space_disk(self):
         labels = ['san_name', 'backend_name', 'pool_name', 'san_ip']
@@ -228,6 +258,20 @@ class SC8000_Metrics(base_driver.Metrics):
             Gauge('san_volume_number_total_io',
                   'Volume Total I/O Rate - ops/s', labels,
                   registry=self.registry)
+        # (gauge, field, divisor) of every IO usage sample of a volume
+        self.IOUsage_volume_metrics = [
+            (self.ReadLatency_san_volume, 'readLatency', 1000),
+            (self.WriteLatency_san_volume, 'writeLatency', 1000),
+            (self.ReadKbPerSecond_san_volume, 'readKbPerSecond', 1),
+            (self.AverageKbPerIo_san_volume, 'averageKbPerIo', 1),
+            (self.WriteKbPerSecond_san_volume, 'writeKbPerSecond', 1),
+            (self.TotalKbPerSecond_san_volume, 'totalKbPerSecond', 1),
+            (self.writeIops_san_volume, 'writeIops', 1),
+            (self.readIops_san_volume, 'readIops', 1),
+            (self.totalIops_san_volume, 'totalIops', 1),
+        ]
+        # Label values of a volume -> its child of every gauge of the table
+        self.IOUsage_volume_children = {}
 
     def define_alert(self):
         labels = [
@@ -268,64 +312,32 @@ class SC8000_Metrics(base_driver.Metrics):
                   'Info servers for the Storage Center', labels,
                   registry=self.registry)
 
+    def set_IOUsage(self, metrics, children, labelvalues, element):
+        # The children of an object are looked up once, at its first sample
+        object_children = children.get(labelvalues)
+        if object_children is None:
+            object_children = children[labelvalues] = \
+                [gauge.labels(*labelvalues) for gauge, _, _ in metrics]
+        for child, (_, field, divisor) in zip(object_children, metrics):
+            child.set(element[field] / divisor)
+
     def parse_IOUsage_volume(self, IOUsage_volume, sanmap):
+        exported = set()
         for p in IOUsage_volume:
             for element in p:
                 san_name = element['scName']
-                self.ReadLatency_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['readLatency'] / 1000)
-                self.WriteLatency_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['writeLatency'] / 1000)
-                self.ReadKbPerSecond_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['readKbPerSecond'])
-                self.AverageKbPerIo_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['averageKbPerIo'])
-                self.WriteKbPerSecond_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['writeKbPerSecond'])
-                self.TotalKbPerSecond_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['totalKbPerSecond'])
-                self.writeIops_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['writeIops'])
-                self.readIops_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['readIops'])
-                self.totalIops_san_volume.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    name_volume=element['instanceName'])\
-                    .set(element['totalIops'])
+                # Same order as the labels of the volume IO usage metrics
+                labelvalues = (element['instanceName'], san_name,
+                               self.backend_name, sanmap[san_name][1])
+                exported.add(labelvalues)
+                self.set_IOUsage(self.IOUsage_volume_metrics,
+                                 self.IOUsage_volume_children, labelvalues,
+                                 element)
+        # Volumes dropped by the volume filter must not be exported anymore
+        for labelvalues in self.IOUsage_volume_children.keys() - exported:
+            del self.IOUsage_volume_children[labelvalues]
+            for gauge, _, _ in self.IOUsage_volume_metrics:
+                gauge.remove(*labelvalues)
 
     def parse_DSM_info(self, DSM_info):
         self.info_san_DSM.info({
@@ -376,74 +388,14 @@ class SC8000_Metrics(base_driver.Metrics):
         for p in IOUsage_controller:
             for element in p:
                 san_name = element['scName']
-                self.san_ip.update(
-                    {map_ip[str(element['instanceId'])]: sanmap[san_name][1]})
-                self.ReadLatency_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['readLatency'] / 1000)
-                self.WriteLatency_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['writeLatency'] / 1000)
-                self.ReadKbPerSecond_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['readKbPerSecond'])
-                self.AverageKbPerIo_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['averageKbPerIo'])
-                self.WriteKbPerSecond_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['writeKbPerSecond'])
-                self.TotalKbPerSecond_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['totalKbPerSecond'])
-                self.writeIops_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['writeIops'])
-                self.readIops_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['readIops'])
-                self.totalIops_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['totalIops'])
-                self.cpuPercentUsage_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['cpuPercentUsage'])
-                self.memoryPercentUsage_san_controller.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    ip_controller=map_ip[str(element['instanceId'])])\
-                    .set(element['memoryPercentUsage'])
+                ip_controller = map_ip[str(element['instanceId'])]
+                self.san_ip.update({ip_controller: sanmap[san_name][1]})
+                # Same order as the labels of the controller IO usage metrics
+                labelvalues = (ip_controller, san_name, self.backend_name,
+                               sanmap[san_name][1])
+                self.set_IOUsage(self.IOUsage_controller_metrics,
+                                 self.IOUsage_controller_children, labelvalues,
+                                 element)
 
     def parse_info_port(self, info_port, sanmap):
         for p in info_port:
@@ -467,60 +419,12 @@ class SC8000_Metrics(base_driver.Metrics):
         for p in IOUsage_port:
             for element in p:
                 san_name = element['scName']
-                self.ReadLatency_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['readLatency'] / 1000)
-                self.WriteLatency_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['writeLatency'] / 1000)
-                self.ReadKbPerSecond_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['readKbPerSecond'])
-                self.AverageKbPerIo_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['averageKbPerIo'])
-                self.WriteKbPerSecond_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['writeKbPerSecond'])
-                self.TotalKbPerSecond_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['totalKbPerSecond'])
-                self.writeIops_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['writeIops'])
-                self.readIops_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['readIops'])
-                self.totalIops_san_port.labels(
-                    san_ip=sanmap[san_name][1],
-                    san_name=san_name,
-                    backend_name=self.backend_name,
-                    instanceid_port=element['instanceName'])\
-                    .set(element['totalIops'])
+                # Same order as the labels of the port IO usage metrics
+                labelvalues = (element['instanceName'], san_name,
+                               self.backend_name, sanmap[san_name][1])
+                self.set_IOUsage(self.IOUsage_port_metrics,
+                                 self.IOUsage_port_children, labelvalues,
+                                 element)
 
     def parse_space_disk(self, space_disk, sanmap):
         for i in space_disk:
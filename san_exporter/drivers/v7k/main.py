@@ -15,10 +15,14 @@
 #
 
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from time import sleep, time
 import requests
 import operator
 
+from san_exporter.utils.http_client import create_http_client
 from san_exporter.utils.utils import cache_data
 
 from san_exporter.drivers import base_driver
@@ -33,6 +37,9 @@ except AttributeError:
     # no pyopenssl support used / needed / available
     pass
 
+# Lifetime of the discovered storage system IDs - s
+SYSTEM_ID_TTL = 86400
+
 OPS = {
     "+": operator.add,
     "-": operator.sub,
@@ -138,6 +145,116 @@ NODE_STATISTIC_METRICS = {
     }
 }
 
+VOLUME_STATISTIC_METRICS = {
+    803: {
+        "name": "san_volume_number_read_io",
+        "description": "Volume Read I/O Rate - ops/s",
+        "type": "gauge"
+    },
+    806: {
+        "name": "san_volume_number_write_io",
+        "description": "Volume Write I/O Rate - ops/s",
+        "type": "gauge"
+    },
+    819: {
+        "name": "san_volume_read_kb",
+        "description": "Volume Read Data Rate - KiB/s",
+        "type": "gauge",
+        "opt": {
+            "*": 1024
+        }
+    },
+    820: {
+        "name": "san_volume_write_kb",
+        "description": "Volume Write Data Rate - KiB/s",
+        "type": "gauge",
+        "opt": {
+            "*": 1024
+        }
+    },
+    822: {
+        "name": "san_volume_read_service_time_ms",
+        "description": "Volume Read Response Time - ms/op",
+        "type": "gauge"
+    },
+    823: {
+        "name": "san_volume_write_service_time_ms",
+        "description": "Volume Write Response Time - ms/op",
+        "type": "gauge"
+    },
+}
+
+MDISK_STATISTIC_METRICS = {
+    803: {
+        "name": "san_mdisk_number_read_io",
+        "description": "Managed Disk Read I/O Rate - ops/s",
+        "type": "gauge"
+    },
+    806: {
+        "name": "san_mdisk_number_write_io",
+        "description": "Managed Disk Write I/O Rate - ops/s",
+        "type": "gauge"
+    },
+    819: {
+        "name": "san_mdisk_read_kb",
+        "description": "Managed Disk Read Data Rate - KiB/s",
+        "type": "gauge",
+        "opt": {
+            "*": 1024
+        }
+    },
+    820: {
+        "name": "san_mdisk_write_kb",
+        "description": "Managed Disk Write Data Rate - KiB/s",
+        "type": "gauge",
+        "opt": {
+            "*": 1024
+        }
+    },
+    822: {
+        "name": "san_mdisk_read_service_time_ms",
+        "description": "Managed Disk Read Response Time - ms/op",
+        "type": "gauge"
+    },
+    823: {
+        "name": "san_mdisk_write_service_time_ms",
+        "description": "Managed Disk Write Response Time - ms/op",
+        "type": "gauge"
+    },
+}
+
+# Performance sections: optional metric, Spectrum Control resource, section of
+# the cached data, label of the object and metric table
+PERF_RESOURCES = [
+    ('cpg_statics', 'Pools', 'pool_perf', 'pool_name', POOL_STATISTIC_METRICS),
+    ('port', 'Nodes', 'node_perf', 'node_name', NODE_STATISTIC_METRICS),
+    ('volume', 'Volumes', 'volume_perf', 'volume_name', VOLUME_STATISTIC_METRICS),
+    ('mdisk', 'ManagedDisks', 'mdisk_perf', 'mdisk_name', MDISK_STATISTIC_METRICS),
+]
+# Metrics summed to select the top volumes: read and write I/O rate
+VOLUME_TOP_METRICS = (803, 806)
+# Due to system report each 5m, the first window is 7.5m to make sure to get the latest value,
+# the next ones start after the last ingested sample - ms
+PERF_WINDOW = 500000
+# Value exported for a metric from the new samples of a cycle
+PERF_AGGREGATIONS = {
+    'latest': lambda values: values[-1],
+    'max': max,
+    'avg': lambda values: sum(values) / len(values),
+}
+
+
+def _compile_metrics(metrics_list):
+    """Resolve the 'opt' conversion of every metric once: metric ID -> (metric, op, operand)"""
+    compiled = {}
+    for metric_id, metric in metrics_list.items():
+        op, operand = None, None
+        if metric.get('opt'):
+            (opt, operand), = metric['opt'].items()
+            op = OPS[opt]
+        compiled[metric_id] = (metric, op, operand)
+    return compiled
+
 
 class HPEStorwizeV7kExporter(base_driver.ExporterDriver):
 
@@ -145,14 +262,35 @@ class HPEStorwizeV7kExporter(base_driver.ExporterDriver):
         super().__init__(config, interval)
         self.ibm_spectrum_control = config['ibm_spectrum_control']
         self._setup_spectrum_control_url()
-        self.target_v7000 = []
         self.backend_name = config['name']
-        self.client = None
+        # The Spectrum Control session is kept across cycles
+        self.client = create_http_client(self.backend_name, self.http_config,
+                                         pool_maxsize=self.max_workers)
+        self.client.verify = False
+        self.logged_in = False
+        self.login_lock = Lock()
+        # Incremented at each login, a worker only logs in again if nobody
+        # refreshed the session since its request
+        self.session_generation = 0
         self.ssh_client = None
-        for v in config['v7000_ip']:
-            self.target_v7000.append({
-                'IP Address': v
-            })
+        # Target V7000s by IP, their Spectrum Control ID is discovered once
+        self.target_v7000 = OrderedDict((ip, {'IP Address': ip}) for ip in config['v7000_ip'])
+        self.system_id_ttl = config.get('system_id_ttl', SYSTEM_ID_TTL)
+        self.system_ids_updated = 0
+        # Enabled performance sections, their conversions are resolved once
+        self.perf_resources = [(resource, section, label, _compile_metrics(metrics_list))
+                               for optional_metric, resource, section, label, metrics_list in PERF_RESOURCES
+                               if self.optional_metrics.get(optional_metric)]
+        # 0: every volume, N: the N volumes with the highest I/O rate
+        self.volume_top = config.get('volume_top', 0)
+        self.perf_aggregation = PERF_AGGREGATIONS[config.get('perf_aggregation', 'latest')]
+        # (storage ID, resource) -> time of the last ingested sample, committed once cached
+        self.last_sample_times = {}
+        self.new_sample_times = {}
+        # (storage ID, resource) -> metrics of the last samples, kept until newer ones are reported
+        self.resource_perfs = {}
+        # (storage ID, resource, problem) of the unexpected responses already logged
+        self.perf_response_warnings = set()
 
     def _setup_spectrum_control_url(self):
         # This is setup for IBM Spectrum Control v5.2
@@ -162,86 +300,173 @@ class HPEStorwizeV7kExporter(base_driver.ExporterDriver):
     def client_spectrum_control_login(self):
         try:
             logging.debug("Connecting to IBM Spectrum control")
-            self.client = requests.session()
+            self.client.cookies.clear()
             # TODO: check login failed here
             self.client.post(self.ibm_spectrum_control['auth_url'],
                              data={'j_username': self.ibm_spectrum_control['username'],
                                    'j_password': self.ibm_spectrum_control['password']},
                              verify=False)
+            self.logged_in = True
+            self.session_generation += 1
             logging.info("Logged in to IBM Spectrum control at: " + self.ibm_spectrum_control['url'])
         except Exception as ex:
             msg = ("Failed to Login to IBM Spectrum control at (%(url)s) because %(err)s" %
                    {'url': self.ibm_spectrum_control['url'], 'err': ex})
             logging.error(msg)
 
-    def _get_system_info(self):
-        data_info = []
-        storage_list = self.client.get(self.ibm_spectrum_control['api_base_url'])
+    def _is_session_expired(self, response):
+        # An expired session is redirected to the login page instead of
+        # returning the JSON resource
+        return response.status_code in (401, 403) or \
+            'application/json' not in response.headers.get('Content-Type', '')
+
+    def _get(self, url):
+        generation = self.session_generation
+        response = self.client.get(url)
+        if self._is_session_expired(response):
+            with self.login_lock:
+                if generation == self.session_generation:
+                    logging.info("IBM Spectrum control session expired, logging in again")
+                    self.client_spectrum_control_login()
+            response = self.client.get(url)
+        response.raise_for_status()
+        return response
+
+    def _discover_system_ids(self):
+        logging.debug("Discovering the storage system IDs of backend: %s", self.backend_name)
+        storage_list = self._get(self.ibm_spectrum_control['api_base_url'])
         for storage in storage_list.json():
-            for v in self.target_v7000:
-                if storage['IP Address'] == v['IP Address']:
-                    v['id'] = storage['id']
-                    target_storage = {
-                        'IP Address': v['IP Address'],
-                        'id': storage['id'],
-                        'system_info': storage
-                    }
-                    nodes_response = self.client.get(self.ibm_spectrum_control['api_base_url'] + "/" +
-                                                     storage['id'] + "/Nodes")
-                    target_storage['nodes'] = nodes_response.json()
-                    data_info.append(target_storage)
-        return data_info
-
-    def _get_pools_info(self):
-        storage_pools = []
-        for v in self.target_v7000:
-            if 'id' not in v:
-                logging.warning('Storage IBM V7000 {} did not have enough information'.format(v))
-                self.target_v7000.remove(v)
+            target = self.target_v7000.get(storage['IP Address'])
+            if target is not None:
+                target['id'] = storage['id']
+        self.system_ids_updated = time()
+        for target in self.target_v7000.values():
+            if 'id' not in target:
+                logging.warning('Storage IBM V7000 {} did not have enough information'.format(target))
+
+    def _get_targets(self):
+        """Configured V7000s with a known ID, the IDs are refreshed after the TTL or on a miss"""
+        if time() - self.system_ids_updated > self.system_id_ttl or \
+                any('id' not in target for target in self.target_v7000.values()):
+            self._discover_system_ids()
+        return [target for target in self.target_v7000.values() if 'id' in target]
+
+    def _get_system_info(self, target):
+        try:
+            response = self._get(self.ibm_spectrum_control['api_base_url'] + "/" + target['id'])
+        except requests.HTTPError as ex:
+            if ex.response is not None and ex.response.status_code == 404:
+                # The system was removed or added again with a new ID
+                target.pop('id', None)
+            raise
+        storage = response.json()
+        return storage[0] if isinstance(storage, list) else storage
+
+    def _get_nodes_info(self, storage_id):
+        nodes_response = self._get(self.ibm_spectrum_control['api_base_url'] + "/" +
+                                   storage_id + "/Nodes")
+        return nodes_response.json()
+
+    def _get_pools_info(self, storage_id):
+        pools_response = self._get(self.ibm_spectrum_control['api_base_url'] + "/" +
+                                   storage_id + "/Pools")
+        return pools_response.json()
+
+    def _get_storage_data(self, target):
+        """Every resource of one V7000"""
+        storage_data = {
+            'system_info': {
+                'IP Address': target['IP Address'],
+                'id': target['id'],
+                'system_info': self._get_system_info(target),
+                'nodes': self._get_nodes_info(target['id'])
+            },
+            'pools_info': {
+                'IP Address': target['IP Address'],
+                'pools': self._get_pools_info(target['id'])
+            }
+        }
+        for resource, section, label, metrics_list in self.perf_resources:
+            storage_data[section] = self.collect_section(section, self._get_resource_perf, resource, label,
+                                                         metrics_list, target['id'], target['IP Address'])
+        return storage_data
+
+    def _select_top_volumes(self, samples):
+        """Keep the samples of the volumes with the highest I/O rate"""
+        io_rates = {}
+        for item, _, value in samples:
+            if item['metricId'] in VOLUME_TOP_METRICS:
+                io_rates[item['deviceName']] = io_rates.get(item['deviceName'], 0) + value
+        top_volumes = set(sorted(io_rates, key=io_rates.get, reverse=True)[:self.volume_top])
+        return [sample for sample in samples if sample[0]['deviceName'] in top_volumes]
+
+    def _warn_perf_response(self, key, problem):
+        """Log a problem of the performance responses once per storage and resource"""
+        if key + (problem,) not in self.perf_response_warnings:
+            self.perf_response_warnings.add(key + (problem,))
+            logging.warning('Unexpected {} performance response of storage {} of backend {}: {}'.format(
+                key[1], key[0], self.backend_name, problem))
+
+    def _get_new_samples(self, key, items, start_time):
+        """Item, time of the newest sample and aggregated value of the metrics with new samples"""
+        samples = []
+        for item in items:
+            if isinstance(item.get('data'), list):
+                # data: [time, value] of every sample of the window
+                points = sorted(point for point in item['data']
+                                if point[0] >= start_time and point[1] is not None)
+                if points:
+                    samples.append((item, points[-1][0], self.perf_aggregation([value for _, value in points])))
+            elif 'maxValue' in item:
+                # No sample in the response: the maximum of the window is
+                # used, its time is unknown so the window does not slide
+                self._warn_perf_response(key, 'no sample data, the maxValue of the window is used')
+                if item['maxValue'] is not None:
+                    samples.append((item, None, item['maxValue']))
             else:
-                pool_data = {
-                    'IP Address': v['IP Address']
-                }
-                pools_response = self.client.get(self.ibm_spectrum_control['api_base_url'] + "/" +
-                                                 v['id'] + "/Pools")
-                pool_data['pools'] = pools_response.json()
-                storage_pools.append(pool_data)
-        return storage_pools
-
-    def _get_resource_perf(self, resource, metrics_list, storage_id, storage_ip):
-        current_epoch_time = time()
-        current_epoch_time = int(current_epoch_time) * 1000
-        # Due to system report ech 5m, so we minus 7.5m here to make sure get only the latest value.
-        last_7m_ago_epoch_time = current_epoch_time - 500000
+                self._warn_perf_response(key, 'metric {} has neither data nor maxValue'.format(item.get('metricId')))
+        return samples
+
+    def _get_resource_perf(self, resource, label, metrics_list, storage_id, storage_ip):
+        """Every metric of every object of a resource type in one request, only the new samples are read"""
+        key = (storage_id, resource)
+        end_time = int(time()) * 1000
+        start_time = end_time - PERF_WINDOW
+        if key in self.last_sample_times:
+            start_time = max(start_time, self.last_sample_times[key] + 1)
         metrics = ','.join(map(str, metrics_list.keys()))
         api = self.ibm_spectrum_control['api_base_url'] + '/' + storage_id + "/" + resource \
-              + "/Performance?metrics=" + metrics + "&startTime=" + str(last_7m_ago_epoch_time)
-        req = self.client.get(api)
-        res = req.json()
-        res = res[1:]
+            + "/Performance?metrics=" + metrics + "&startTime=" + str(start_time) + "&endTime=" + str(end_time)
+        res = self._get(api).json()
+        if not isinstance(res, list):
+            self._warn_perf_response(key, 'not a list of metrics')
+            return self.resource_perfs.get(key, [])
+        samples = self._get_new_samples(key, res[1:], start_time)
+        if not samples:
+            # No sample was reported since the last cycle
+            return self.resource_perfs.get(key, [])
+        sample_times = [sample_time for _, sample_time, _ in samples if sample_time is not None]
+        if sample_times:
+            self.new_sample_times[key] = max(sample_times)
+        if resource == 'Volumes' and self.volume_top:
+            samples = self._select_top_volumes(samples)
         resource_perf = []
-        for item in res:
-            metric = metrics_list[item['metricId']]
+        for item, _, value in samples:
+            metric, op, operand = metrics_list[item['metricId']]
             labels = {
                 'san_ip': storage_ip,
-                'backend_name': self.backend_name
+                'backend_name': self.backend_name,
+                label: item['deviceName'].split('<')[0]
             }
-            if resource == 'Pools':
-                labels['pool_name'] = item['deviceName'].split('<')[0]
-            elif resource == 'Nodes':
-                labels['node_name'] = item['deviceName'].split('<')[0]
-            if metric.get('opt'):
-                value = OPS[list(metric['opt'].keys())[0]](item['maxValue'], list(metric['opt'].values())[0])
-            else:
-                value = item['maxValue']
             metric_converted = {
                 'name': metric['name'],
                 'labels': labels,
                 'type': metric.get('type', 'gauge'),
                 'description': metric['description'],
-                'value': value
+                'value': op(value, operand) if op else value
             }
             resource_perf.append(metric_converted)
+        self.resource_perfs[key] = resource_perf
         return resource_perf
 
     def run(self):   # noqa: C901
@@ -251,30 +476,33 @@ class HPEStorwizeV7kExporter(base_driver.ExporterDriver):
                     logging.debug('Backend {} is sleeping for {}'.format(self.ibm_spectrum_control, self.interval))
                     sleep(self.interval)
                     continue
-                self.client_spectrum_control_login()
-                data = {}
-                system_info = self._get_system_info()
-                data['system_info'] = system_info
-
-                pools_info = self._get_pools_info()
-                data['pools_info'] = pools_info
-
-                if self.optional_metrics.get('cpg_statics'):
-                    data['pool_perf'] = []
-                    for v in self.target_v7000:
-                        perf = self._get_resource_perf('Pools', POOL_STATISTIC_METRICS, v['id'], v['IP Address'])
-                        data['pool_perf'] += perf
-
-                if self.optional_metrics.get('port'):
-                    data['node_perf'] = []
-                    for v in self.target_v7000:
-                        perf = self._get_resource_perf('Nodes', NODE_STATISTIC_METRICS, v['id'], v['IP Address'])
-                        data['node_perf'] = perf
+                if not self.collect_allowed():
+                    sleep(self.interval)
+                    continue
+                if not self.logged_in:
+                    with self.login_lock:
+                        self.client_spectrum_control_login()
+                targets = self._get_targets()
+                self.new_sample_times = {}
+                # The V7000s are fetched concurrently, max_workers bounds the
+                # number of requests in flight to the Spectrum Control server
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    storages_data = list(executor.map(self._get_storage_data, targets))
+                data = {
+                    'system_info': [d['system_info'] for d in storages_data],
+                    'pools_info': [d['pools_info'] for d in storages_data]
+                }
+                for _, section, _, _ in self.perf_resources:
+                    data[section] = [perf for d in storages_data for perf in d[section]]
 
                 # caching data to file using pickle
                 cache_data(self.cache_file, data)
+                # The samples are ingested, the next cycle only requests newer ones
+                self.last_sample_times.update(self.new_sample_times)
+                self.new_sample_times = {}
+                self.collect_succeeded()
             except BaseException:
-                logging.error('Error: ', exc_info=True)
+                self.collect_failed()
 
             sleep(self.interval)
 
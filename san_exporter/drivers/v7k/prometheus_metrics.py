@@ -153,10 +153,12 @@ class HPEStorwizeV7kMetrics(base_driver.Metrics):
     def parse_metrics(self, data):
         self.parse_system_info(data['system_info'])
         self.parse_pool_info(data['pools_info'])
-        if self.optional_metrics.get('cpg_statics'):
-            self.parse_perf_metrics(data['pool_perf'])
-        if self.optional_metrics.get('port'):
-            self.parse_perf_metrics(data['node_perf'])
+        # Volumes out of the top-N must not be exported anymore
+        for metric in self.perf_metrics.values():
+            metric._metrics.clear()
+        for section in ('pool_perf', 'node_perf', 'volume_perf', 'mdisk_perf'):
+            if section in data:
+                self.parse_perf_metrics(data[section])
 
     def get_metrics(self):
         metrics = generate_latest(self.registry)
@@ -16,6 +16,9 @@
 
 import os
 import logging
+import signal
+import sys
+import threading
 from time import time
 
 import yaml
@@ -24,6 +27,7 @@ from flask import Flask, Response, render_template
 import urllib3
 
 from san_exporter.drivers import load_driver
+from san_exporter.utils import instrumentation
 from san_exporter.utils.utils import get_data
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -68,6 +72,17 @@ def config_logging(log_file):
             level=logging.INFO)
 
 
+def shutdown(signum, frame):
+    """Release the resources held on the storages before the exporter stops"""
+    logging.info('Stopping exporter on signal %s...', signum)
+    for backend_name, (exporter, _) in running_backends.items():
+        try:
+            exporter.shutdown()
+        except Exception:
+            logging.warning('Can not shut down backend %s', backend_name, exc_info=True)
+    sys.exit(0)
+
+
 # Entry point of app
 def create_app():
     global config
@@ -105,6 +120,10 @@ def create_app():
             running_backends[backend_config['name']] = rb
             # running_backends = {'3par1111': (HPE3ParExporter,
             # HPE3ParMetrics), ...}
+    # Signal handlers can only be installed from the main thread
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
     return app
 
 
@@ -115,6 +134,16 @@ def index():
         enabled_backends=config['enabled_backends'])
 
 
+@app.route('/exporter_metrics')
+def exporter_metrics():
+    return Response(
+        instrumentation.get_metrics(),
+        headers={
+            "Content-Type": "text/plain"
+        }
+    )
+
+
 @app.route('/<backend_name>')
 def do_get(backend_name):
     global running_backends
@@ -128,15 +157,26 @@ def do_get(backend_name):
                 if backend.get('timeout'):
                     timeout = backend['timeout']
         cached = get_data(cache_file)
-        running_backends[backend_name][0].time_last_request = time()
-        if (running_backends[backend_name][0].time_last_request - cached[1]['time']) > timeout:
+        exporter = running_backends[backend_name][0]
+        exporter.time_last_request = time()
+        data_age = exporter.time_last_request - cached[1]['time']
+        # While the circuit of the backend is not closed, the last collected
+        # data is served and marked as stale
+        circuit_state = exporter.circuit_breaker.state
+        stale = circuit_state != exporter.circuit_breaker.CLOSED
+        if data_age > timeout and not stale:
             message = 'Data timeout in cache file of storage backend: ' + backend_name
             logging.warning(message)
             return message
         data = cached[0]
         backend = running_backends[backend_name][1]
+        start = time()
         backend.parse_metrics(data)
+        backend.parse_collection_metrics(backend_name, circuit_state, data_age, stale)
         metrics = backend.get_metrics()
+        instrumentation.scrape_render_duration.labels(backend_name=backend_name).set(time() - start)
+        instrumentation.snapshot_series.labels(backend_name=backend_name).set(
+            sum(1 for line in metrics.splitlines() if line and not line.startswith(b'#')))
         return Response(
             metrics,
             headers={
@@ -0,0 +1,105 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Pooled HTTP client shared by the drivers using a REST API."""
+
+import logging
+from threading import Lock
+from time import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from san_exporter.utils import instrumentation
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+POOL_MAXSIZE = 4
+# Response status of an overloaded or restarting API, worth retrying
+RETRY_STATUS = [502, 503, 504]
+
+
+class HTTPClient(requests.Session):
+    """
+    requests session of a backend.
+
+    Connections are pooled and kept alive between requests and collection
+    cycles, every request gets the default timeouts unless it sets its own,
+    idempotent requests are retried with an exponential backoff and the
+    latency of every request is recorded.
+    """
+
+    def __init__(self, name, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 retries=RETRIES, backoff_factor=BACKOFF_FACTOR, pool_maxsize=POOL_MAXSIZE):
+        super().__init__()
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(total=retries, backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUS, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize,
+                              max_retries=retry)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self.stats_lock = Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'latency_seconds': 0.0,
+                      'max_latency_seconds': 0.0}
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        start = time()
+        try:
+            response = super().request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record(method, url, time() - start, error=True)
+            raise
+        self._record(method, url, time() - start, error=response.status_code >= 400)
+        return response
+
+    def _record(self, method, url, latency, error=False):
+        logging.debug("[%s] %s %s took %.3fs", self.name, method, url, latency)
+        instrumentation.observe_api_call(self.name, method, url, latency, error=error)
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['latency_seconds'] += latency
+            self.stats['max_latency_seconds'] = max(self.stats['max_latency_seconds'], latency)
+            if error:
+                self.stats['errors'] += 1
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+
+def create_http_client(name, config=None, pool_maxsize=POOL_MAXSIZE):
+    """
+    Create the HTTP client of a backend.
+
+    :param name: backend name, used in the logs
+    :param config: 'http' section of the config: connect_timeout, read_timeout,
+        retries and backoff_factor
+    :param pool_maxsize: number of connections kept alive, should be the number
+        of concurrent requests of the backend
+    """
+    config = config or {}
+    return HTTPClient(name,
+                      connect_timeout=config.get('connect_timeout', CONNECT_TIMEOUT),
+                      read_timeout=config.get('read_timeout', READ_TIMEOUT),
+                      retries=config.get('retries', RETRIES),
+                      backoff_factor=config.get('backoff_factor', BACKOFF_FACTOR),
+                      pool_maxsize=pool_maxsize)
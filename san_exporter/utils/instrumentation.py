@@ -0,0 +1,73 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Self metrics of the exporter, exposed on /exporter_metrics."""
+
+import re
+from urllib.parse import urlparse
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+COLLECTION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600)
+API_CALL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Path segments holding an ID but not an API version, e.g. /v1/StorageSystems/1234 -> /v1/StorageSystems/:id
+ID_SEGMENT = re.compile(r'/(?!v\d+(?:/|$))[^/]*\d[^/]*')
+
+REGISTRY = CollectorRegistry()
+
+collection_duration = Histogram(
+    'san_exporter_collection_duration_seconds', 'Duration of the collections of the backend - s',
+    ['backend_name'], buckets=COLLECTION_BUCKETS, registry=REGISTRY)
+section_duration = Gauge(
+    'san_exporter_section_duration_seconds', 'Duration of the last collection of a section - s',
+    ['backend_name', 'section'], registry=REGISTRY)
+last_success = Gauge(
+    'san_exporter_last_success_timestamp_seconds', 'Time of the last successful collection',
+    ['backend_name'], registry=REGISTRY)
+consecutive_failures = Gauge(
+    'san_exporter_consecutive_failures', 'Number of failed collections since the last successful one',
+    ['backend_name'], registry=REGISTRY)
+snapshot_bytes = Gauge(
+    'san_exporter_snapshot_bytes', 'Size of the cached data of the backend - bytes',
+    ['backend_name'], registry=REGISTRY)
+snapshot_series = Gauge(
+    'san_exporter_snapshot_series', 'Number of series of the last scrape of the backend',
+    ['backend_name'], registry=REGISTRY)
+api_calls = Counter(
+    'san_exporter_api_calls', 'Number of API calls sent to the backend',
+    ['backend_name', 'endpoint', 'status'], registry=REGISTRY)
+api_call_duration = Histogram(
+    'san_exporter_api_call_duration_seconds', 'Latency of the API calls sent to the backend - s',
+    ['backend_name', 'endpoint'], buckets=API_CALL_BUCKETS, registry=REGISTRY)
+scrape_render_duration = Gauge(
+    'san_exporter_scrape_render_seconds', 'Duration of the rendering of the last scrape of the backend - s',
+    ['backend_name'], registry=REGISTRY)
+
+
+def get_endpoint(method, url):
+    """Endpoint of an API call, the IDs are masked to bound the number of series"""
+    return method.upper() + ' ' + ID_SEGMENT.sub('/:id', urlparse(url).path)
+
+
+def observe_api_call(backend_name, method, url, latency, error=False):
+    endpoint = get_endpoint(method, url)
+    api_calls.labels(backend_name=backend_name, endpoint=endpoint,
+                     status='error' if error else 'ok').inc()
+    api_call_duration.labels(backend_name=backend_name, endpoint=endpoint).observe(latency)
+
+
+def get_metrics():
+    return generate_latest(REGISTRY)
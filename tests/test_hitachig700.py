@@ -0,0 +1,78 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import signal
+import unittest
+from unittest import mock
+
+from san_exporter import main
+from san_exporter.drivers import base_driver
+from san_exporter.drivers.hitachig700.main import HitachiG700Exporter
+
+CONFIG = {
+    'name': 'hitachi_test',
+    'VSP_api_ip': '127.0.0.1',
+    'VSP_api_port': '23451',
+    'username': 'user',
+    'password': 'password',
+    'serial': '0',
+}
+BASE_URL = 'https://127.0.0.1:23451/ConfigurationManager/v1/objects/storages/0'
+
+
+def create_exporter():
+    # The global config.yml is not needed to test the driver
+    with mock.patch.object(base_driver, 'load_config', return_value={}):
+        exporter = HitachiG700Exporter(dict(CONFIG))
+    exporter.baseURL = BASE_URL
+    exporter.headers = {}
+    exporter.session = mock.Mock()
+    exporter.session.post.return_value.json.return_value = {'token': 'token', 'sessionId': 7}
+    return exporter
+
+
+class TestSessionShutdown(unittest.TestCase):
+
+    def test_shutdown_deletes_session(self):
+        exporter = create_exporter()
+        exporter.get_session_token()
+        exporter.shutdown()
+        exporter.session.delete.assert_called_once_with(
+            BASE_URL + '/sessions/7', headers=mock.ANY, verify=False)
+        self.assertIsNone(exporter.session_id)
+
+    def test_no_session_after_shutdown(self):
+        exporter = create_exporter()
+        exporter.shutdown()
+        self.assertIsNone(exporter.get_session_token())
+        exporter.session.post.assert_not_called()
+        exporter.session.delete.assert_not_called()
+
+    def test_signal_handler_deletes_sessions(self):
+        exporter = create_exporter()
+        exporter.get_session_token()
+        with mock.patch.object(main, 'running_backends', {CONFIG['name']: (exporter, None)}):
+            with self.assertRaises(SystemExit):
+                main.shutdown(signal.SIGTERM, None)
+        exporter.session.delete.assert_called_once_with(
+            BASE_URL + '/sessions/7', headers=mock.ANY, verify=False)
+
+    def test_driver_thread_is_daemon(self):
+        self.assertTrue(create_exporter().daemon)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import unittest
+from time import time
+from unittest import mock
+
+from san_exporter.drivers import base_driver
+from san_exporter.drivers.v7k.main import HPEStorwizeV7kExporter, POOL_STATISTIC_METRICS, _compile_metrics
+
+CONFIG = {
+    'name': 'v7k_test',
+    'ibm_spectrum_control': {'url': 'https://127.0.0.1:9569', 'username': 'user', 'password': 'password'},
+    'v7000_ip': ['10.0.0.1'],
+    'optional_metrics': {'cpg_statics': True},
+}
+STORAGE_ID = '1234'
+
+
+def create_exporter():
+    # The global config.yml is not needed to test the driver
+    with mock.patch.object(base_driver, 'load_config', return_value={}):
+        exporter = HPEStorwizeV7kExporter(dict(CONFIG))
+    return exporter
+
+
+def get_pool_perf(exporter, payload):
+    response = mock.Mock()
+    response.json.return_value = payload
+    with mock.patch.object(exporter, '_get', return_value=response):
+        return exporter._get_resource_perf('Pools', 'pool_name', _compile_metrics(POOL_STATISTIC_METRICS),
+                                           STORAGE_ID, '10.0.0.1')
+
+
+class TestResourcePerf(unittest.TestCase):
+
+    def test_max_value_payload(self):
+        # Shape of the responses read before the samples were requested
+        exporter = create_exporter()
+        payload = [{}, {'metricId': 803, 'deviceName': 'pool1<10.0.0.1>', 'maxValue': 120}]
+        with self.assertLogs(level='WARNING') as logs:
+            perf = get_pool_perf(exporter, payload)
+        self.assertEqual([(m['name'], m['labels']['pool_name'], m['value']) for m in perf],
+                         [('san_pool_number_read_io', 'pool1', 120)])
+        self.assertIn('maxValue', logs.output[0])
+        # The time of the maximum is unknown, the window does not slide
+        self.assertNotIn((STORAGE_ID, 'Pools'), exporter.new_sample_times)
+
+    def test_data_payload(self):
+        exporter = create_exporter()
+        now = int(time()) * 1000
+        payload = [{}, {'metricId': 803, 'deviceName': 'pool1<10.0.0.1>',
+                        'data': [[now - 2000, 100], [now - 1000, 110]]}]
+        perf = get_pool_perf(exporter, payload)
+        self.assertEqual([m['value'] for m in perf], [110])
+        self.assertEqual(exporter.new_sample_times[(STORAGE_ID, 'Pools')], now - 1000)
+
+    def test_unexpected_payload(self):
+        exporter = create_exporter()
+        with self.assertLogs(level='WARNING'):
+            perf = get_pool_perf(exporter, [{}, {'metricId': 803, 'deviceName': 'pool1'}])
+        self.assertEqual(perf, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
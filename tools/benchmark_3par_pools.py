@@ -0,0 +1,110 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Time the CPG lookups of the 3PAR driver (HPE3ParExporter._get_pools_info)
+against the 3PAR mock server of python-3parclient.
+
+Start the mock server as in docs/quickstart_with_simulator.md:
+
+    $ python test/HPE3ParMockServer_flask.py -port 5001 -user hpe3par_admin -password hpe3par_password -debug
+
+then from the root of san_exporter:
+
+    $ python tools/benchmark_3par_pools.py --cpgs 40 --workers 1 4 8
+
+The mock server only has a few CPGs, the configured pools list repeats
+them to get --cpgs lookups per collection. --latency adds a delay to every
+WSAPI request to emulate a real array.
+"""
+
+import argparse
+import os
+import sys
+from itertools import cycle, islice
+from time import sleep, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from san_exporter.drivers import base_driver  # noqa: E402
+from san_exporter.drivers.hpe3par.main import HPE3ParExporter  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5001/api/v1', help='WSAPI URL of the mock server')
+    parser.add_argument('--username', default='hpe3par_admin')
+    parser.add_argument('--password', default='hpe3par_password')
+    parser.add_argument('--cpgs', type=int, default=40, help='number of CPG lookups per collection')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help='max_workers values to compare')
+    parser.add_argument('--rounds', type=int, default=5, help='collections timed for each max_workers value')
+    parser.add_argument('--latency', type=float, default=0.02, help='delay added to every WSAPI request - s')
+    return parser.parse_args()
+
+
+def create_exporter(args):
+    # The global config.yml is not needed to time the driver code
+    base_driver.load_config = lambda: {}
+    config = {
+        'name': 'benchmark_3par',
+        'hpe3par_api_url': args.url,
+        'hpe3par_username': args.username,
+        'hpe3par_password': args.password,
+        'san_ssh_ip': '127.0.0.1',
+        'san_ssh_user': args.username,
+        'san_ssh_pass': args.password,
+        'san_ssh_port': 22,
+        'pools': 'all',
+    }
+    exporter = HPE3ParExporter(config)
+    exporter.client = exporter._create_client()
+    exporter.client_login()
+    return exporter
+
+
+def add_latency(client, latency):
+    request = client.http.request
+
+    def delayed_request(*args, **kwargs):
+        sleep(latency)
+        return request(*args, **kwargs)
+    client.http.request = delayed_request
+
+
+def main():
+    args = parse_args()
+    exporter = create_exporter(args)
+    client = exporter.client
+    names = [cpg['name'] for cpg in client.getCPGs()['members']]
+    exporter.config['pools'] = ','.join(islice(cycle(names), args.cpgs))
+    exporter.get_all_pools = False
+    add_latency(client, args.latency)
+    try:
+        print('%s CPG lookups, %.0f ms per WSAPI request, %s rounds' % (
+            args.cpgs, args.latency * 1000, args.rounds))
+        for workers in args.workers:
+            exporter.max_workers = workers
+            start = time()
+            for _ in range(args.rounds):
+                exporter._get_pools_info()
+            print('max_workers=%-3s %.3f s per collection' % (workers, (time() - start) / args.rounds))
+    finally:
+        del client.http.request
+        exporter.client_logout()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Time the alert/hardware correlation of the Hitachi G700 driver
+(HitachiG700Exporter.get_alert_metrics) on a large generated alert log.
+
+The VSP responses of the cycle are served from the per-cycle memo, so only
+the correlation and deduplication are timed. The previous implementation
+(nested loops over alerts, action codes and hardware, JSON deduplication)
+is timed on the same fixture for comparison:
+
+    $ python tools/benchmark_hitachi_alerts.py --alerts 20000 --hardware 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from san_exporter.drivers import base_driver  # noqa: E402
+from san_exporter.drivers.hitachig700.main import HitachiG700Exporter  # noqa: E402
+
+HARDWARE_TYPES = ['chbs', 'dkbs', 'bkmfs', 'lanbs', 'dkcpss', 'cacheFlashMemories', 'cacheMemories']
+ALERTS_PATH = '/alerts?type=DKC&type=CTL1&type=CTL2'
+HARDWARE_PATH = '/components/instance'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--alerts', type=int, default=20000, help='alerts of the alert log')
+    parser.add_argument('--hardware', type=int, default=2000, help='hardware components')
+    parser.add_argument('--unhealthy', type=float, default=0.05, help='ratio of the unhealthy components')
+    parser.add_argument('--action-codes', type=int, default=3, help='action codes per alert')
+    parser.add_argument('--rounds', type=int, default=3, help='timed runs of each implementation')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def generate_fixture(args):
+    random.seed(args.seed)
+    locations = ['LOC-%s' % i for i in range(args.hardware)]
+    hardware = {hw_type: [] for hw_type in HARDWARE_TYPES}
+    for location in locations:
+        status = 'Blocked' if random.random() < args.unhealthy else 'Normal'
+        hardware[random.choice(HARDWARE_TYPES)].append({'location': location, 'status': status})
+    hardware['driveBoxes'] = []
+    hardware['ctls'] = [{'location': 'CTL1', 'status': 'Normal'}, {'location': 'CTL2', 'status': 'Normal'}]
+    alerts = []
+    for i in range(args.alerts):
+        # Alerts repeat, a few hundred distinct ones in the log
+        alert_id = random.randrange(args.alerts // 50 + 1)
+        alerts.append({
+            'errorDetail': 'Error %s' % alert_id,
+            'errorLevel': random.choice(['Moderate', 'Service']),
+            'errorSection': 'Section %s' % (alert_id % 10),
+            'location': 'LOC-%s' % (alert_id % args.hardware),
+            'actionCodes': [{'accLocation': random.choice(locations)} for _ in range(args.action_codes)],
+        })
+    return {ALERTS_PATH: {'data': alerts}, HARDWARE_PATH: hardware}
+
+
+def legacy_alert_metrics(exporter):
+    """get_alert_metrics before the location index and tuple deduplication"""
+    alert_info = exporter.get_alert_info()
+    unhealthy_hw = exporter.get_unhealthy_hardware()
+    alert_metrics = []
+    for al in alert_info:
+        resolved = True
+        for i in al['actionCodes']:
+            for hw in unhealthy_hw:
+                if i['accLocation'] == hw['location']:
+                    resolved = False
+        alert_metrics.append({'errorDetail': al['errorDetail'],
+                              'errorLevel': al['errorLevel'] if resolved else 'Serious',
+                              'errorSection': al['errorSection'],
+                              'location': al['location']})
+    return [json.loads(s) for s in set(json.dumps(d, sort_keys=True) for d in alert_metrics)]
+
+
+def create_exporter():
+    # The global config.yml is not needed to time the driver code
+    base_driver.load_config = lambda: {}
+    config = {
+        'name': 'benchmark_hitachig700',
+        'VSP_api_ip': '127.0.0.1',
+        'VSP_api_port': '23451',
+        'username': 'user',
+        'password': 'password',
+        'serial': '0',
+    }
+    exporter = HitachiG700Exporter(config)
+    exporter.baseURL = 'https://127.0.0.1/ConfigurationManager/v1/objects/storages/0'
+    exporter.headers = {}
+    return exporter
+
+
+def timed(function, exporter, fixture, rounds):
+    start = time()
+    for _ in range(rounds):
+        # A new cycle: the memo only holds the fixture responses
+        exporter.responses = dict(fixture)
+        result = function(exporter)
+    return (time() - start) / rounds, result
+
+
+def main():
+    args = parse_args()
+    fixture = generate_fixture(args)
+    exporter = create_exporter()
+    print('%s alerts, %s hardware components, %s action codes per alert, %s rounds' % (
+        args.alerts, args.hardware, args.action_codes, args.rounds))
+    current, alerts = timed(HitachiG700Exporter.get_alert_metrics, exporter, fixture, args.rounds)
+    legacy, legacy_alerts = timed(legacy_alert_metrics, exporter, fixture, args.rounds)
+    key = lambda alert: (alert['errorDetail'], alert['errorLevel'], alert['errorSection'], alert['location'])  # noqa: E731
+    assert sorted(map(key, alerts)) == sorted(map(key, legacy_alerts)), 'the implementations disagree'
+    print('get_alert_metrics  %.3f s, %s alerts exported' % (current, len(alerts)))
+    print('legacy             %.3f s' % legacy)
+
+
+if __name__ == '__main__':
+    main()
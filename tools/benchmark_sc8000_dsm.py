@@ -0,0 +1,183 @@
+#
+#    Copyright (C) 2021 Viettel Networks
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""
+Time one collection of the SC8000 driver (SC8000_Exporter.get_data) against
+a local DSM stand-in.
+
+The stand-in answers the DSM REST requests of the driver for --scs Storage
+Centers with --controllers controllers, --ports ports and --volumes volumes
+each, every response is delayed by --latency to emulate the DSM:
+
+    $ python tools/benchmark_sc8000_dsm.py --scs 4 --workers 1 4 8
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from san_exporter.drivers import base_driver  # noqa: E402
+from san_exporter.drivers.sc8000.main import DSM_TIME_FORMAT, SC8000_Exporter  # noqa: E402
+
+DSM_ID = '1'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scs', type=int, default=4, help='Storage Centers behind the DSM')
+    parser.add_argument('--controllers', type=int, default=2, help='controllers per Storage Center')
+    parser.add_argument('--ports', type=int, default=16, help='controller ports per Storage Center')
+    parser.add_argument('--volumes', type=int, default=200, help='volumes per Storage Center')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help='max_workers values to compare')
+    parser.add_argument('--rounds', type=int, default=3, help='collections timed for each max_workers value')
+    parser.add_argument('--latency', type=float, default=0.02, help='delay of every DSM response - s')
+    return parser.parse_args()
+
+
+def io_usage(**fields):
+    usage = {'time': datetime.now().strftime(DSM_TIME_FORMAT), 'readIops': 100, 'writeIops': 50,
+             'totalIops': 150, 'readKbPerSecond': 800, 'writeKbPerSecond': 400, 'totalKbPerSecond': 1200,
+             'readLatency': 1000, 'writeLatency': 2000, 'averageKbPerIo': 8}
+    usage.update(fields)
+    return usage
+
+
+class DSMStandIn(object):
+    """Responses of the DSM REST API used by the driver, a handler gets the SC ID of the path"""
+
+    def __init__(self, args):
+        self.args = args
+        self.routes = [
+            ('POST', r'ApiConnection/Log(?:in|out)$', lambda _: {}),
+            ('GET', r'ApiConnection/ApiConnection$', lambda _: {'instanceId': DSM_ID}),
+            ('GET', r'ApiConnection/ApiConnection/\w+/StorageCenterList$', self.storage_centers),
+            ('GET', r'StorageCenter/StorageCenter/(\w+)/ControllerList$', self.controllers),
+            ('GET', r'StorageCenter/StorageCenter/(\w+)/ControllerPortList$', self.ports),
+            ('GET', r'StorageCenter/StorageCenter/\w+/(?:StorageTypeStorageUsage|AlertList|ServerList)$', lambda _: []),
+            ('GET', r'StorageCenter/StorageCenter/\w+/StorageUsage$', lambda _: {}),
+            ('POST', r'StorageCenter/StorageCenter/(\w+)/GetLatestVolumeIoUsage$', self.volumes),
+            ('POST', r'StorageCenter/(?:ScController|ScControllerPort)/[\w.]+/GetHistoricalIoUsage$',
+             lambda _: [io_usage()]),
+        ]
+
+    def storage_centers(self, _):
+        return [{'name': 'SC%s' % sc, 'instanceId': str(sc), 'hostOrIpAddress': '10.0.0.%s' % sc}
+                for sc in range(self.args.scs)]
+
+    def controllers(self, sc):
+        return [{'instanceId': '%s.%s' % (sc, controller), 'ipAddress': '10.0.%s.%s' % (sc, controller)}
+                for controller in range(self.args.controllers)]
+
+    def ports(self, sc):
+        return [{'instanceId': '%s.%s' % (sc, port)} for port in range(self.args.ports)]
+
+    def volumes(self, sc):
+        return [io_usage(scName='SC%s' % sc, instanceName='volume%s' % volume)
+                for volume in range(self.args.volumes)]
+
+    def respond(self, method, path):
+        for route_method, pattern, handler in self.routes:
+            match = re.search(pattern, path)
+            if route_method == method and match:
+                return handler(match.group(1) if match.groups() else None)
+        return None
+
+
+def start_dsm(args):
+    dsm = DSMStandIn(args)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def handle_request(self, method):
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            sleep(args.latency)
+            body = dsm.respond(method, self.path)
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(404 if body is None else 200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self.handle_request('GET')
+
+        def do_POST(self):
+            self.handle_request('POST')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_exporter(port, workers):
+    # The global config.yml is not needed to time the driver code
+    base_driver.load_config = lambda: {}
+    config = {
+        'name': 'benchmark_sc8000',
+        'DSM_api_ip': '127.0.0.1',
+        'DSM_api_port': port,
+        'DSM_username': 'user',
+        'DSM_password': 'password',
+        'sc8000_ip': 'all',
+        'verify_cert': False,
+        'apiversion': '3.5',
+        'max_workers': workers,
+    }
+    exporter = SC8000_Exporter(config)
+    # The stand-in serves plain HTTP
+    exporter.baseURL = 'http://127.0.0.1:%s/api/rest/' % port
+    return exporter
+
+
+def main():
+    args = parse_args()
+    server = start_dsm(args)
+    port = server.server_address[1]
+    print('%s SCs, %s controllers, %s ports and %s volumes per SC, %.0f ms per DSM request, %s rounds' % (
+        args.scs, args.controllers, args.ports, args.volumes, args.latency * 1000, args.rounds))
+    try:
+        for workers in args.workers:
+            # A new exporter per value: the connection pool is sized by max_workers
+            exporter = create_exporter(port, workers)
+            start = time()
+            for _ in range(args.rounds):
+                exporter.login()
+                exporter.get_data()
+                exporter.logout()
+            stats = exporter.session.get_stats()
+            print('max_workers=%-3s %.3f s per collection, %s requests' % (
+                workers, (time() - start) / args.rounds, stats['requests'] // args.rounds))
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()